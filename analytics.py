@@ -0,0 +1,107 @@
+import time
+
+from audience import SCORE_FIELDS, score_condition
+
+# Сводка по событию одними агрегатными запросами к SQLite: в Python
+# попадают только гистограммы и счетчики, а не строки участников.
+
+
+def score_stats(histogram: dict) -> dict:
+    # histogram: оценка -> количество ответов
+    total = sum(histogram.values())
+    if not total:
+        return {"answers": 0}
+    mean = sum(score * count for score, count in histogram.items()) / total
+    # Медиана по гистограмме без разворачивания в список
+    middle = [(total - 1) // 2, total // 2]
+    found = []
+    seen = 0
+    for score in sorted(histogram):
+        seen += histogram[score]
+        while len(found) < 2 and middle[len(found)] < seen:
+            found.append(score)
+    promoters = sum(count for score, count in histogram.items() if score >= 9)
+    detractors = sum(count for score, count in histogram.items() if score <= 6)
+    return {
+        "answers": total,
+        "mean": round(mean, 2),
+        "median": sum(found) / 2,
+        "nps": round((promoters - detractors) * 100 / total, 1),
+        "distribution": dict(sorted(histogram.items())),
+    }
+
+
+def scores(db, event_id: str) -> dict:
+    result = {}
+    for field in SCORE_FIELDS:
+        rows = db.execute(
+            f"SELECT CAST({field} AS INTEGER) AS score, COUNT(*) FROM attendees "
+            f"WHERE event = ? AND {score_condition(field)} GROUP BY score",
+            (event_id,),
+        )
+        result[field] = score_stats(dict(rows))
+    return result
+
+
+def breakdown(db, event_id: str, field: str) -> dict:
+    rows = db.execute(
+        f"SELECT {field}, COUNT(*) FROM attendees WHERE event = ? GROUP BY {field} ORDER BY 2 DESC",
+        (event_id,),
+    )
+    return dict(rows)
+
+
+def funnel(db, fsm_db, event_id: str, steps) -> list:
+    # Сколько пользователей дошли до каждого шага регистрации. Незавершенные
+    # регистрации лежат в таблице fsm; завершенные — уже в attendees.
+    # steps — шаги по порядку, каждый шаг — список FSM-состояний
+    # (ветка вроде custom_direction считается тем же шагом).
+    registered = db.execute("SELECT COUNT(*) FROM attendees WHERE event = ?", (event_id,)).fetchone()[0]
+    waiting = {}
+    if fsm_db is not None:
+        rows = fsm_db.execute(
+            "SELECT state, COUNT(*) FROM fsm WHERE expires_at > ? "
+            "AND json_extract(data, '$.event') = ? GROUP BY state",
+            (time.time(), event_id),
+        )
+        waiting = dict(rows)
+    result = []
+    reached = registered
+    for states in reversed(steps):
+        stopped = sum(waiting.get(state, 0) for state in states)
+        reached += stopped
+        result.append({"state": states[0], "reached": reached, "stopped": stopped})
+    result.reverse()
+    result.append({"state": "registered", "reached": registered, "stopped": 0})
+    return result
+
+
+def report(db, fsm_db, event_id: str, steps) -> dict:
+    return {
+        "event": event_id,
+        "funnel": funnel(db, fsm_db, event_id, steps),
+        "scores": scores(db, event_id),
+        "status": breakdown(db, event_id, "status"),
+        "direction": breakdown(db, event_id, "direction"),
+        "experience": breakdown(db, event_id, "experience"),
+    }
+
+
+def render(report: dict) -> str:
+    # Короткий текст для /stats в Telegram
+    lines = [f"📊 {report['event']}", "", "Воронка регистрации:"]
+    for step in report["funnel"]:
+        lines.append(f"  {step['state']}: {step['reached']} (остановились: {step['stopped']})")
+    lines += ["", "Оценки:"]
+    for field, stats in report["scores"].items():
+        if stats["answers"]:
+            lines.append(
+                f"  {field}: среднее {stats['mean']}, медиана {stats['median']}, "
+                f"NPS {stats['nps']} ({stats['answers']} ответов)"
+            )
+        else:
+            lines.append(f"  {field}: нет ответов")
+    for title, key in (("Статусы", "status"), ("Направления", "direction"), ("Опыт", "experience")):
+        lines += ["", f"{title}:"]
+        lines += [f"  {value or '—'}: {count}" for value, count in report[key].items()]
+    return "\n".join(lines)
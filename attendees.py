@@ -0,0 +1,70 @@
+import asyncio
+import logging
+
+import sheets
+from store import FIELDS, Store
+
+
+class Attendee:
+    __slots__ = FIELDS
+
+    def __init__(self, row):
+        for name, value in zip(FIELDS, row):
+            setattr(self, name, value)
+
+
+class Attendees:
+    # Участники одного события. Читаем и пишем в локальный Store,
+    # в таблицу изменения уходят через SheetMirror. Таблица читается
+    # только один раз — для первичного импорта события, и только из
+    # фоновых задач: хендлеры работают с локальными строками.
+
+    def __init__(self, store: Store, event_id: str, worksheet=0):
+        self.store = store
+        self.event_id = event_id
+        self.worksheet = worksheet
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return self.store.count(self.event_id)
+
+    @property
+    def imported(self) -> bool:
+        return self.store.is_imported(self.event_id)
+
+    async def ensure_imported(self) -> bool:
+        # False — импорт пока не удался, в Store есть только локальные строки
+        if self.imported:
+            return True
+        async with self._lock:
+            if self.store.is_imported(self.event_id):
+                return True
+            try:
+                records = await sheets.get_all_values(self.worksheet)
+            except Exception as e:
+                logging.error(f"Attendees import error for {self.event_id}: {e}")
+                return False
+            if records is None:
+                return False
+            imported = self.store.import_rows(self.event_id, records)
+            logging.info(f"Imported {imported} attendees for {self.event_id} from Sheets")
+            return True
+
+    def get(self, user_id: int):
+        row = self.store.get(self.event_id, user_id)
+        return Attendee(row) if row else None
+
+    def ids(self, statuses=None):
+        return self.store.ids(self.event_id, statuses)
+
+    def audience(self, audience):
+        return self.store.audience(self.event_id, audience)
+
+    def upsert(self, row_data):
+        self.store.upsert_registration(self.event_id, row_data)
+
+    def set_status(self, user_id: int, status: str) -> bool:
+        return self.store.set_status(self.event_id, user_id, status)
+
+    def set_feedback(self, user_id: int, answers):
+        self.store.save_feedback(self.event_id, user_id, answers)
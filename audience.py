@@ -0,0 +1,72 @@
+import re
+
+# Фильтры аудитории для точечных рассылок, например:
+#   direction=Marketing; experience>=3-6 лет; job_offers=Да; q1>=8
+# Несколько значений через запятую: status=Coming,Wait
+
+# Значения кнопок опыта по возрастанию — для сравнений >= и <=
+EXPERIENCE_LEVELS = ("нет опыта", "менее 1 года", "1-3 года", "3-6 лет", "более 6 лет")
+
+CHOICE_FIELDS = ("status", "direction", "experience", "job_offers", "known_g5")
+SCORE_FIELDS = ("q1", "q2", "q3", "q4")
+
+_CONDITION = re.compile(r"^\s*(\w+)\s*(>=|<=|!=|=)\s*(.+?)\s*$")
+
+
+class AudienceError(ValueError):
+    pass
+
+
+def score_condition(field: str) -> str:
+    # Оценкой считается только целое 1..10: пустой ответ или свободный
+    # текст CAST превращает в 0 (или в число из начала строки), такие
+    # строки в оценки не попадают. CAST совпадает с индексом (event, qN)
+    return f"{field} != '' AND {field} NOT GLOB '*[^0-9]*' AND CAST({field} AS INTEGER) BETWEEN 1 AND 10"
+
+
+class Audience:
+    # Разобранный запрос. where/params подставляются в Store.audience,
+    # все поля идут по индексам (event, <поле>).
+
+    def __init__(self, event_id=None, where=(), params=(), description=""):
+        self.event_id = event_id
+        self.where = list(where)
+        self.params = list(params)
+        self.description = description
+
+    @classmethod
+    def parse(cls, text: str):
+        audience = cls(description=text.strip())
+        for part in filter(str.strip, text.split(";")):
+            match = _CONDITION.match(part)
+            if not match:
+                raise AudienceError(f"Не понимаю условие «{part.strip()}»")
+            field, op, value = match.groups()
+            if field == "event":
+                audience.event_id = value
+            elif field in SCORE_FIELDS:
+                audience._score(field, op, value)
+            elif field in CHOICE_FIELDS:
+                audience._choice(field, op, value)
+            else:
+                raise AudienceError(f"Неизвестное поле «{field}»")
+        return audience
+
+    def _choice(self, field: str, op: str, value: str):
+        if op in (">=", "<="):
+            if field != "experience" or value not in EXPERIENCE_LEVELS:
+                raise AudienceError(f"Сравнение {op} работает только для experience: {', '.join(EXPERIENCE_LEVELS)}")
+            level = EXPERIENCE_LEVELS.index(value)
+            values = EXPERIENCE_LEVELS[level:] if op == ">=" else EXPERIENCE_LEVELS[:level + 1]
+            op = "="
+        else:
+            values = [item.strip() for item in value.split(",") if item.strip()]
+        placeholders = ", ".join("?" * len(values))
+        self.where.append(f"{field} {'NOT IN' if op == '!=' else 'IN'} ({placeholders})")
+        self.params.extend(values)
+
+    def _score(self, field: str, op: str, value: str):
+        if not value.isdigit():
+            raise AudienceError(f"Оценка должна быть числом: «{value}»")
+        self.where.append(f"{score_condition(field)} AND CAST({field} AS INTEGER) {op} ?")
+        self.params.append(int(value))
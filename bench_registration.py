@@ -0,0 +1,278 @@
+"""Офлайн-бенчмарк воронки регистрации и опроса.
+
+Поднимает фейковый Telegram Bot API (aiohttp), подменяет лист Google
+на фейковый и прогоняет виртуальных пользователей через Registration и
+Feedback. Печатает пропускную способность, p50/p99 времени ответа и
+число запросов к Sheets на регистрацию.
+
+    python bench_registration.py --users 10 100 1000 > bench_output.txt
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from collections import Counter
+
+_tmp = tempfile.mkdtemp(prefix="g5-bench-")
+os.environ["BOT_TOKEN"] = "123456:bench"
+os.environ["DB_PATH"] = os.path.join(_tmp, "bench.db")
+os.environ.setdefault("SHEETS_FLUSH_INTERVAL", "0.5")
+
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from aiohttp import web  # noqa: E402
+from gspread.utils import a1_to_rowcol  # noqa: E402
+
+import bot  # noqa: E402
+import sheets  # noqa: E402
+from store import SheetMirror  # noqa: E402
+
+
+# --- ФЕЙКОВЫЙ TELEGRAM ---
+
+
+class FakeTelegram:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = Counter()
+        self._message_id = 0
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        self.requests[method] += 1
+        form = await request.post()
+        await asyncio.sleep(self.latency)
+        if method == "sendMessage":
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(form["chat_id"]), "type": "private"},
+                "text": form.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+# --- ФЕЙКОВЫЙ ЛИСТ ---
+
+
+class FakeWorksheet:
+    # Повторяет те методы gspread.Worksheet, которые вызывает sheets.py.
+    # Задержка имитирует поход в Google из потока пула.
+
+    def __init__(self, sheet_id: int, latency: float):
+        self.id = sheet_id
+        self.latency = latency
+        self.requests = Counter()
+        self.rows = [["user_id", "username", "full_name", "email", "direction", "company",
+                      "experience", "job_offers", "known_g5", "status"]]
+        self._lock = threading.Lock()
+
+    def _request(self, name):
+        self.requests[name] += 1
+        time.sleep(self.latency)
+
+    def col_values(self, col):
+        self._request("col_values")
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def get_all_values(self):
+        self._request("get_all_values")
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def append_rows(self, values):
+        self._request("append_rows")
+        with self._lock:
+            start = len(self.rows) + 1
+            self.rows.extend(list(row) for row in values)
+            return {"updates": {"updatedRange": f"Sheet1!A{start}:J{len(self.rows)}"}}
+
+    def batch_update(self, data):
+        self._request("batch_update")
+        with self._lock:
+            for item in data:
+                start = item["range"].split(":")[0]
+                row, col = a1_to_rowcol(start)
+                target = self.rows[row - 1]
+                for offset, value in enumerate(item["values"][0]):
+                    while len(target) < col + offset:
+                        target.append("")
+                    target[col - 1 + offset] = value
+
+
+# --- ВИРТУАЛЬНЫЕ ПОЛЬЗОВАТЕЛИ ---
+
+
+class VirtualUser:
+    def __init__(self, user_id: int, event_id: str):
+        self.user_id = user_id
+        self.event_id = event_id
+        self._update_id = 0
+        self.latencies = []
+
+    def _base(self):
+        self._update_id += 1
+        return {"update_id": self.user_id * 100 + self._update_id}
+
+    def _user(self):
+        return {"id": self.user_id, "is_bot": False, "first_name": "Bench", "username": f"u{self.user_id}"}
+
+    def message(self, text: str):
+        update = self._base()
+        update["message"] = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": self._user(),
+            "text": text,
+        }
+        return Update.model_validate(update)
+
+    def callback(self, data: str):
+        update = self._base()
+        update["callback_query"] = {
+            "id": str(self._update_id),
+            "from": self._user(),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": self.user_id, "type": "private"},
+                "text": "feedback",
+            },
+        }
+        return Update.model_validate(update)
+
+    async def _send(self, update: Update):
+        started = time.perf_counter()
+        await bot.dp.feed_update(bot.bot, update)
+        self.latencies.append(time.perf_counter() - started)
+
+    async def register(self):
+        script = [
+            f"/start {self.event_id}",
+            f"Bench User {self.user_id}",
+            f"u{self.user_id}@example.com",
+            "Marketing",
+            "G5 Games",
+            "3-6 лет",
+            "Да",
+            "Нет",
+        ]
+        for text in script:
+            await self._send(self.message(text))
+
+    async def feedback(self):
+        await self._send(self.callback(f"start_feedback:{self.event_id}"))
+        for text in ["9", "8", "10", "7", "-"]:
+            await self._send(self.message(text))
+
+
+# --- ПРОГОН ---
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_level(users_count: int, level: int, telegram: FakeTelegram, sheets_latency: float):
+    worksheet = FakeWorksheet(sheet_id=level, latency=sheets_latency)
+    sheets.get_worksheet = lambda key=0: worksheet
+    event = bot.events.default()
+    await event.attendees.ensure_imported()
+
+    users = [VirtualUser(level * 1_000_000 + i, event.id) for i in range(users_count)]
+    telegram.requests.clear()
+
+    # Время фазы — до ответа последнего пользователя, зеркало в таблицу
+    # досинхронизируется после замера
+    mirror = bot.mirror = SheetMirror(bot.store, {event.id: event.worksheet})
+    mirror.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user.register() for user in users))
+    registration_time = time.perf_counter() - started
+    await mirror.stop()
+    registration_requests = sum(worksheet.requests.values())
+
+    mirror.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user.feedback() for user in users))
+    feedback_time = time.perf_counter() - started
+    await mirror.stop()
+    bot.store.listeners.remove(mirror.notify)
+
+    latencies = [value for user in users for value in user.latencies]
+    updates = len(latencies)
+    registered = sum(1 for row in worksheet.rows[1:] if row[0].isdigit())
+    with_feedback = sum(1 for row in worksheet.rows[1:] if len(row) >= 15 and row[14])
+    return {
+        "users": users_count,
+        "updates/s": updates / (registration_time + feedback_time),
+        "p50 ms": percentile(latencies, 50) * 1000,
+        "p99 ms": percentile(latencies, 99) * 1000,
+        "sheets req/reg": registration_requests / users_count,
+        "sheets req total": sum(worksheet.requests.values()),
+        "tg req": sum(telegram.requests.values()),
+        "registered": registered,
+        "feedback": with_feedback,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--sheets-latency", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    telegram = FakeTelegram(args.telegram_latency)
+    base = await telegram.start()
+    bot.bot.session.api = TelegramAPIServer.from_base(base)
+
+    results = []
+    try:
+        for level, users_count in enumerate(args.users, start=1):
+            results.append(await run_level(users_count, level, telegram, args.sheets_latency))
+    finally:
+        await telegram.stop()
+        await bot.bot.session.close()
+
+    columns = list(results[0])
+    print(" | ".join(f"{name:>16}" for name in columns))
+    for row in results:
+        cells = [f"{row[name]:>16.2f}" if isinstance(row[name], float) else f"{row[name]:>16}" for name in columns]
+        print(" | ".join(cells))
+
+    failed = [row for row in results if row["registered"] != row["users"] or row["feedback"] != row["users"]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,61 +1,70 @@
 import os
-import base64
 import json
+import signal
 import asyncio
 import logging
+from datetime import datetime
 
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandStart, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import (
-    ReplyKeyboardMarkup,
-    KeyboardButton,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-    ReplyKeyboardRemove,
-)
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
-import gspread
-from google.oauth2.service_account import Credentials
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from pytz import timezone
 
+import analytics
+import cluster
+import keyboards
+import metrics
+from audience import Audience, AudienceError
+from broadcast import RATE_LIMIT, Broadcaster, DeliveryLog, SharedTokenBucket
+from events import EventRegistry
+from fsm_storage import SQLiteStorage, create_storage
+from store import SheetMirror, Store
+from throttling import ThrottlingMiddleware
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
 # --- НАСТРОЙКИ ---
 TOKEN = os.getenv("BOT_TOKEN")
-SHEET_NAME = os.getenv("SHEET_NAME")
-GOOGLE_CAL = os.getenv("GOOGLE_CAL_URL")
-APPLE_CAL = os.getenv("APPLE_CAL_URL")
+# Свой Bot API сервер (например, локальный telegram-bot-api)
+TELEGRAM_API = os.getenv("TELEGRAM_API")
+EVENTS_FILE = os.getenv("EVENTS_FILE", "events.json")
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+FSM_STORAGE = os.getenv("FSM_STORAGE", DB_PATH)
+SCHEDULER_DB = os.getenv("SCHEDULER_DB", f"sqlite:///{DB_PATH}")
+# Насколько поздно (в секундах) еще можно отправить пропущенную рассылку
+MISFIRE_GRACE = int(os.getenv("SCHEDULER_MISFIRE_GRACE", 3600))
+
+# Если задан WEBHOOK_URL — работаем через вебхук вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_HANDLERS = int(os.getenv("WEBHOOK_MAX_HANDLERS", 100))
+
+# WORKERS > 1 — несколько процессов-воркеров за фронтом (см. cluster.py).
+# WORKER_INDEX выставляет сам фронт для дочерних процессов.
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_INDEX = os.getenv("WORKER_INDEX")
+WORKER_PORT = int(os.getenv("WORKER_PORT", 10100))
+
+# Пауза между попытками первичного импорта участников из таблицы
+IMPORT_RETRY = int(os.getenv("SHEETS_IMPORT_RETRY", 60))
+
+# Telegram id организаторов через запятую: им доступны /audience и /broadcast
+ADMIN_IDS = {int(item) for item in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if item}
+# /stats по HTTP отдается только с ?token=<STATS_TOKEN>; без токена эндпоинт закрыт
+STATS_TOKEN = os.getenv("STATS_TOKEN")
 
-PHOTO_LINK = "https://starodubtsevnikita.com/disk/26-02-2026-g5-meeting-02-26-2026-belgrade-540bw8"
-MAPS_URL = "https://maps.app.goo.gl/VohpNtSW4BuU3rx89"
 BELGRADE_TZ = timezone("Europe/Belgrade")
 
 
-def get_gspread_client():
-    try:
-        encoded_json = os.getenv("SERVICE_ACCOUNT_B64")
-        if not encoded_json:
-            logging.error("SERVICE_ACCOUNT_B64 is not set")
-            return None
-
-        decoded_json = json.loads(base64.b64decode(encoded_json.strip()))
-        creds = Credentials.from_service_account_info(
-            decoded_json,
-            scopes=[
-                "https://www.googleapis.com/auth/spreadsheets",
-                "https://www.googleapis.com/auth/drive",
-            ],
-        )
-        return gspread.authorize(creds)
-    except Exception as e:
-        logging.error(f"Gspread Error: {e}")
-        return None
-
-
 class Registration(StatesGroup):
     full_name = State()
     email = State()
@@ -67,6 +76,18 @@ class Registration(StatesGroup):
     known_g5 = State()
 
 
+# Шаги воронки регистрации для отчета /stats
+FUNNEL = [
+    [Registration.full_name.state],
+    [Registration.email.state],
+    [Registration.direction.state, Registration.custom_direction.state],
+    [Registration.company.state],
+    [Registration.experience.state],
+    [Registration.job_offers.state],
+    [Registration.known_g5.state],
+]
+
+
 class Feedback(StatesGroup):
     q1 = State()
     q2 = State()
@@ -75,23 +96,108 @@ class Feedback(StatesGroup):
     q5 = State()
 
 
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
-scheduler = AsyncIOScheduler(timezone=BELGRADE_TZ)
+bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API)) if TELEGRAM_API else None)
+dp = Dispatcher(storage=create_storage(FSM_STORAGE))
+scheduler = AsyncIOScheduler(
+    timezone=BELGRADE_TZ,
+    jobstores={"default": SQLAlchemyJobStore(url=SCHEDULER_DB)},
+    job_defaults={"misfire_grace_time": MISFIRE_GRACE, "coalesce": True, "max_instances": 1},
+)
+# С несколькими воркерами лимит отправки один на всех — через SQLite
+broadcaster = Broadcaster(
+    bot,
+    DeliveryLog(DB_PATH),
+    bucket=SharedTokenBucket(DB_PATH, RATE_LIMIT) if WORKERS > 1 else None,
+)
+bot.session.middleware(metrics.TelegramMetricsMiddleware())
+dp.update.outer_middleware(metrics.UpdateMetricsMiddleware())
+dp.update.outer_middleware(ThrottlingMiddleware())
+store = Store(DB_PATH)
+events = EventRegistry.load(EVENTS_FILE, store)
+mirror = SheetMirror(store, {event.id: event.worksheet for event in events})
+
+
+# --- АДМИНКА ---
+
+is_admin = F.from_user.id.in_(ADMIN_IDS)
+
+
+async def resolve_audience(message: types.Message, args: str):
+    # Первая строка — фильтры, остальное — текст рассылки
+    filters, _, text = (args or "").partition("\n")
+    try:
+        audience = Audience.parse(filters)
+    except AudienceError as e:
+        await message.answer(str(e))
+        return None
+    event = events.get(audience.event_id) if audience.event_id else events.default()
+    if event is None:
+        await message.answer(f"Нет события {audience.event_id}")
+        return None
+    return event, event.attendees.audience(audience), text.strip()
+
+
+@dp.message(Command("audience"), is_admin)
+async def cmd_audience(message: types.Message, command: CommandObject):
+    resolved = await resolve_audience(message, command.args)
+    if resolved:
+        event, chat_ids, _ = resolved
+        await message.answer(f"{event.id}: {len(chat_ids)} получателей")
+
+
+@dp.message(Command("broadcast"), is_admin)
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    resolved = await resolve_audience(message, command.args)
+    if not resolved:
+        return
+    event, chat_ids, text = resolved
+    if not text:
+        await message.answer("Формат: /broadcast фильтры\nтекст сообщения")
+        return
+    # message_id уникален только в пределах чата
+    campaign = f"{event.id}:manual-{message.chat.id}-{message.message_id}"
+    await message.answer(f"Запускаю {campaign}: {len(chat_ids)} получателей")
+    asyncio.create_task(run_manual_campaign(message, campaign, chat_ids, text))
+
+
+def event_report(event) -> dict:
+    # Воронка доступна, только если FSM лежит в SQLite
+    fsm_db = dp.storage.db if isinstance(dp.storage, SQLiteStorage) else None
+    return analytics.report(store.db, fsm_db, event.id, FUNNEL)
+
+
+@dp.message(Command("stats"), is_admin)
+async def cmd_stats(message: types.Message, command: CommandObject):
+    event = events.get(command.args) if command.args else events.default()
+    if event is None:
+        await message.answer(f"Нет события {command.args}")
+        return
+    await message.answer(analytics.render(event_report(event)))
+
+
+async def run_manual_campaign(message: types.Message, campaign: str, chat_ids, text: str):
+    result = await broadcaster.send(chat_ids, text, campaign=campaign, parse_mode="HTML")
+    logging.info(f"{campaign}: {result}")
+    await message.answer(f"{campaign}: {result}")
 
 
 # --- РЕГИСТРАЦИЯ ---
 
 
+async def current_event(state: FSMContext):
+    data = await state.get_data()
+    return events.get(data.get("event")) or events.default()
+
+
 @dp.message(CommandStart())
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(message: types.Message, state: FSMContext, command: CommandObject):
     await state.clear()
-    await message.answer(
-        "Здравствуйте! 👋\n\n"
-        "Вы регистрируетесь на митап от G5 Games:\n"
-        "«Продукт и маркетинг в геймдеве».\n\n"
-        "(1/7) Введите ваши имя и фамилию:"
-    )
+    # /start приходит и после разблокировки бота (кнопка «Перезапустить»)
+    broadcaster.unblock(message.chat.id)
+    # Ссылка вида t.me/<bot>?start=<event_id> выбирает событие
+    event = events.get(command.args) or events.default()
+    await state.update_data(event=event.id)
+    await message.answer(event.text("greeting"))
     await state.set_state(Registration.full_name)
 
 
@@ -109,17 +215,7 @@ async def process_email(message: types.Message, state: FSMContext):
         return
 
     await state.update_data(email=message.text.strip())
-    kb = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Game Design"), KeyboardButton(text="Product / Analytics")],
-            [KeyboardButton(text="Art / Design"), KeyboardButton(text="Development")],
-            [KeyboardButton(text="Marketing"), KeyboardButton(text="QA")],
-            [KeyboardButton(text="Management / Lead"), KeyboardButton(text="HR / Recruitment")],
-            [KeyboardButton(text="Другое")],
-        ],
-        resize_keyboard=True,
-    )
-    await message.answer("(3/7) В каком направлении вы сейчас работаете?", reply_markup=kb)
+    await message.answer("(3/7) В каком направлении вы сейчас работаете?", reply_markup=keyboards.DIRECTION)
     await state.set_state(Registration.direction)
 
 
@@ -127,7 +223,7 @@ async def process_email(message: types.Message, state: FSMContext):
 async def process_direction(message: types.Message, state: FSMContext):
     text = message.text.strip()
     if text == "Другое":
-        await message.answer("Пожалуйста, укажите ваше направление вручную:", reply_markup=ReplyKeyboardRemove())
+        await message.answer("Пожалуйста, укажите ваше направление вручную:", reply_markup=keyboards.REMOVE)
         await state.set_state(Registration.custom_direction)
         return
     await state.update_data(direction=text)
@@ -141,325 +237,204 @@ async def process_custom_direction(message: types.Message, state: FSMContext):
 
 
 async def ask_company(message: types.Message, state: FSMContext):
-    await message.answer("(4/7) В какой компании вы работаете?", reply_markup=ReplyKeyboardRemove())
+    await message.answer("(4/7) В какой компании вы работаете?", reply_markup=keyboards.REMOVE)
     await state.set_state(Registration.company)
 
 
 @dp.message(Registration.company)
 async def process_company(message: types.Message, state: FSMContext):
     await state.update_data(company=message.text.strip())
-    kb = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="нет опыта"), KeyboardButton(text="менее 1 года")],
-            [KeyboardButton(text="1-3 года"), KeyboardButton(text="3-6 лет")],
-            [KeyboardButton(text="более 6 лет")],
-        ],
-        resize_keyboard=True,
-    )
-    await message.answer("(5/7) Ваш опыт работы в геймдеве:", reply_markup=kb)
+    await message.answer("(5/7) Ваш опыт работы в геймдеве:", reply_markup=keyboards.EXPERIENCE)
     await state.set_state(Registration.experience)
 
 
 @dp.message(Registration.experience)
 async def process_exp(message: types.Message, state: FSMContext):
     await state.update_data(experience=message.text.strip())
-    kb = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Да"), KeyboardButton(text="Нет")]],
-        resize_keyboard=True,
-    )
-    await message.answer("(6/7) Вы рассматриваете новые рабочие предложения?", reply_markup=kb)
+    await message.answer("(6/7) Вы рассматриваете новые рабочие предложения?", reply_markup=keyboards.YES_NO)
     await state.set_state(Registration.job_offers)
 
 
 @dp.message(Registration.job_offers)
 async def process_offers(message: types.Message, state: FSMContext):
     await state.update_data(job_offers=message.text.strip())
-    kb = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Да"), KeyboardButton(text="Нет")]],
-        resize_keyboard=True,
-    )
-    await message.answer("(7/7) Знали ли вы про компанию G5 Games ранее?", reply_markup=kb)
+    await message.answer("(7/7) Знали ли вы про компанию G5 Games ранее?", reply_markup=keyboards.YES_NO)
     await state.set_state(Registration.known_g5)
 
 
 @dp.message(Registration.known_g5)
 async def finish_reg(message: types.Message, state: FSMContext):
     await state.update_data(known_g5=message.text.strip())
+    event = await current_event(state)
     data = await state.get_data()
     user_id = str(message.from_user.id)
     username = f"@{message.from_user.username}" if message.from_user.username else "N/A"
 
-    try:
-        client = get_gspread_client()
-        if client:
-            sheet = client.open(SHEET_NAME).get_worksheet(0)
-            row_data = [
-                user_id, username, data.get("full_name", ""),
-                data.get("email", ""), data.get("direction", ""),
-                data.get("company", ""), data.get("experience", ""),
-                data.get("job_offers", ""), data.get("known_g5", ""),
-                "Wait"
-            ]
-            cell = sheet.find(user_id)
-            if cell:
-                target_range = f"A{cell.row}:J{cell.row}"
-                sheet.update(range_name=target_range, values=[row_data])
-            else:
-                sheet.append_row(row_data)
-    except Exception as e:
-        logging.error(f"GSpread write error: {e}")
-
-    cal_kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="🗓 Google Календарь", url=GOOGLE_CAL)],
-            [InlineKeyboardButton(text="🍎 Apple Календарь", url=APPLE_CAL)],
-        ]
-    )
+    row_data = [
+        user_id, username, data.get("full_name", ""),
+        data.get("email", ""), data.get("direction", ""),
+        data.get("company", ""), data.get("experience", ""),
+        data.get("job_offers", ""), data.get("known_g5", ""),
+        "Wait"
+    ]
+    event.attendees.upsert(row_data)
+
     await message.answer(
-        f"{data.get('full_name', 'Участник')}, спасибо за регистрацию! 🎉\n\n"
-        "Ждем вас на митапе от G5 Games:\n"
-        "«Продукт и маркетинг в геймдеве»\n"
-        "26 февраля в 18:00, Кнеза Милоша 12 (CDT Hub).\n\n"
-        "Добавьте событие в календарь:",
-        reply_markup=cal_kb
+        event.text("registered", full_name=data.get("full_name", "Участник")),
+        reply_markup=keyboards.calendar(event)
     )
-    await message.answer("До встречи!", reply_markup=ReplyKeyboardRemove())
+    await message.answer("До встречи!", reply_markup=keyboards.REMOVE)
     await state.clear()
 
 
 # --- СТАТУСЫ ---
 
 
-async def update_status(user_id: int, status: str):
-    try:
-        client = get_gspread_client()
-        if client:
-            sheet = client.open(SHEET_NAME).get_worksheet(0)
-            cell = sheet.find(str(user_id))
-            if cell:
-                sheet.update_cell(cell.row, 10, status)
-    except Exception as e:
-        logging.error(f"Status update error: {e}")
+STATUS_REPLIES = {
+    "Coming": "Отлично! Вы в списке участников.\nДо встречи на митапе 👋",
+    "Declined": (
+        "Понимаем, планы меняются 🙂\nСпасибо, что предупредили!\n\n"
+        "Следите за анонсами будущих митапов в канале @g5careers."
+    ),
+}
+
+
+def update_status(event, user_id: int, status: str) -> bool:
+    # False — такой статус уже стоит, повторное нажатие ничего не меняет
+    if event is None or event.attendees.set_status(user_id, status):
+        return True
+    metrics.updates_dropped.inc("applied")
+    return False
+
+
+@dp.callback_query(F.data.startswith("confirm:"))
+async def confirm_event(callback: types.CallbackQuery):
+    await callback.answer()
+    event_id, _, status = callback.data.removeprefix("confirm:").rpartition(":")
+    event = events.get(event_id)
+    if event is None or status not in STATUS_REPLIES:
+        return
+    if update_status(event, callback.from_user.id, status):
+        await callback.message.answer(STATUS_REPLIES[status], reply_markup=keyboards.REMOVE)
+
+
+# Текстовые кнопки из напоминаний, разосланных до появления inline-кнопок:
+# события в них нет, берем ближайшее, на которое пользователь записан
 
 
 @dp.message(F.text == "✅ Я буду!")
 async def confirm_yes(message: types.Message):
-    await update_status(message.from_user.id, "Coming")
-    await message.answer("Отлично! Вы в списке участников.\nДо встречи на митапе 👋", reply_markup=ReplyKeyboardRemove())
+    if update_status(events.find_for_user(message.from_user.id), message.from_user.id, "Coming"):
+        await message.answer(STATUS_REPLIES["Coming"], reply_markup=keyboards.REMOVE)
 
 
 @dp.message(F.text == "❌ Изменились планы")
 async def confirm_no(message: types.Message):
-    await update_status(message.from_user.id, "Declined")
-    await message.answer(
-        "Понимаем, планы меняются 🙂\nСпасибо, что предупредили!\n\n"
-        "Следите за анонсами будущих митапов в канале @g5careers.",
-        reply_markup=ReplyKeyboardRemove()
-    )
+    if update_status(events.find_for_user(message.from_user.id), message.from_user.id, "Declined"):
+        await message.answer(STATUS_REPLIES["Declined"], reply_markup=keyboards.REMOVE)
 
 
 # --- РАССЫЛКИ ---
 
 
-async def send_reminder_24h():
-    client = get_gspread_client()
-    if not client:
-        return
-    sheet = client.open(SHEET_NAME).get_worksheet(0)
-    records = sheet.get_all_values()
-    kb = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="❌ Изменились планы"), KeyboardButton(text="✅ Я буду!")]],
-        resize_keyboard=True,
-    )
-    text = (
-        "🔔 Уже завтра митап от G5 Games: «Продукт и маркетинг в геймдеве»\n"
-        "📅 26 февраля, 18:00\n"
-        f"📍 <a href='{MAPS_URL}'>CDT Hub, Кнеза Милоша 12</a>\n\n"
-        "Подскажите, пожалуйста, планируете ли вы прийти?"
+async def send_reminder_24h(event):
+    # Без импорта из таблицы рассылаем по локальным строкам
+    await event.attendees.ensure_imported()
+    result = await broadcaster.send(
+        event.attendees.ids(),
+        event.broadcast_text("reminder_24h", escape=True),
+        campaign=f"{event.id}:reminder_24h",
+        reply_markup=keyboards.confirm(event),
+        parse_mode="HTML"
     )
-    for row in records[1:]:
-        try:
-            val = str(row[0]).strip()
-            if not val.isdigit():
-                continue
-            await bot.send_message(int(val), text, reply_markup=kb, parse_mode="HTML")
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            logging.error(f"24h error for {row[0]}: {e}")
+    logging.info(f"{event.id} 24h reminder: {result}")
 
 
-async def send_reminder_3h():
-    client = get_gspread_client()
-    if not client:
-        return
-    sheet = client.open(SHEET_NAME).get_worksheet(0)
-    records = sheet.get_all_values()
-    text = (
-        "🚀 Сегодня в 18:00 — G5 Games Meetup «Продукт и маркетинг в геймдеве».\n"
-        "Обсудим тренды мобильных игр, продуктовые решения и ошибки, которые стоят дорого.\n\n"
-        f"До скорой встречи в <a href='{MAPS_URL}'>CDT Hub</a>!"
+async def send_reminder_3h(event):
+    await event.attendees.ensure_imported()
+    result = await broadcaster.send(
+        event.attendees.ids(["Coming", "Wait"]),
+        event.broadcast_text("reminder_3h", escape=True),
+        campaign=f"{event.id}:reminder_3h",
+        parse_mode="HTML"
     )
-    for row in records[1:]:
-        try:
-            val = str(row[0]).strip()
-            if not val.isdigit():
-                continue
-            status = row[9] if len(row) > 9 else "Wait"
-            if status in ["Coming", "Wait"]:
-                await bot.send_message(int(val), text, parse_mode="HTML")
-                await asyncio.sleep(0.05)
-        except Exception as e:
-            logging.error(f"3h error for {row[0]}: {e}")
+    logging.info(f"{event.id} 3h reminder: {result}")
 
 
-async def send_feedback_request():
-    client = get_gspread_client()
-    if not client:
-        return
-    sheet = client.open(SHEET_NAME).get_worksheet(0)
-    records = sheet.get_all_values()
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Да, хочу", callback_data="start_feedback")],
-            [InlineKeyboardButton(text="Нет, спасибо", callback_data="decline_feedback")],
-        ]
-    )
-    for row in records[1:]:
-        try:
-            val = str(row[0]).strip()
-            if not val.isdigit():
-                continue
-            status = row[9] if len(row) > 9 else "Wait"
-            if status in ["Coming", "Wait"]:
-                await bot.send_message(
-                    int(val),
-                    "Спасибо, что были с нами на G5 Games Meetup 💙\n"
-                    "Нам очень важно ваше мнение — оно помогает делать наши события лучше.\n"
-                    "Хотите поделиться обратной связью? Это займет не больше 2 минут.",
-                    reply_markup=kb
-                )
-                await asyncio.sleep(0.05)
-        except Exception as e:
-            logging.error(f"Feedback request error for {row[0]}: {e}")
-
-
-async def send_photos_link():
-    client = get_gspread_client()
-    if not client:
-        return
-    sheet = client.open(SHEET_NAME).get_worksheet(0)
-    records = sheet.get_all_values()
-
-    msg = (
-        "📸 <b>Фото с G5 Games Meetup уже доступны!</b>\n\n"
-        f"Ссылка: {PHOTO_LINK}\n\n"
-        "Делитесь фотографиями в соцсетях и отмечайте @g5careers — будем рады видеть ваши публикации ✨ "
-        "Самые яркие репостнем в наших сторис 💙\n\n"
-        "🔗 <a href='https://www.linkedin.com/company/g5games/'>LinkedIn</a> | "
-        "<a href='https://www.facebook.com/g5careers/'>Facebook</a> | "
-        "<a href='https://www.instagram.com/g5careers/'>Instagram</a>\n\n"
-        "Ждем вас на следующем мероприятии!"
+async def send_feedback_request(event):
+    await event.attendees.ensure_imported()
+    result = await broadcaster.send(
+        event.attendees.ids(["Coming", "Wait"]),
+        event.broadcast_text("feedback_request"),
+        campaign=f"{event.id}:feedback_request",
+        reply_markup=keyboards.feedback_invite(event)
     )
+    logging.info(f"{event.id} feedback request: {result}")
 
-    for row in records[1:]:
-        try:
-            val = str(row[0]).strip()
-            if not val.isdigit():
-                continue
-            status = row[9] if len(row) > 9 else "Wait"
 
-            if status in ["Coming", "Wait"]:
-                await bot.send_message(
-                    chat_id=int(val),
-                    text=msg,
-                    parse_mode="HTML",
-                    disable_web_page_preview=False
-                )
-                await asyncio.sleep(0.05)
-        except Exception as e:
-            logging.error(f"Photo link error for {row[0]}: {e}")
+async def send_photos_link(event):
+    await event.attendees.ensure_imported()
+    result = await broadcaster.send(
+        event.attendees.ids(["Coming", "Wait"]),
+        event.broadcast_text("photos_link", escape=True),
+        campaign=f"{event.id}:photos_link",
+        parse_mode="HTML",
+        disable_web_page_preview=False
+    )
+    logging.info(f"{event.id} photo link: {result}")
 
 
 # --- ОПРОС ---
 
 
-@dp.callback_query(F.data == "start_feedback")
+@dp.callback_query(F.data.startswith("start_feedback"))
 async def feedback_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
-    kb = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=str(i)) for i in range(1, 6)],
-            [KeyboardButton(text=str(i)) for i in range(6, 11)]
-        ],
-        resize_keyboard=True,
-    )
-    await callback.message.answer(
-        "(1/5) Какое у вас общее впечатление от мероприятия?\n(1 — совсем не понравился, 10 — очень понравился)",
-        reply_markup=kb
-    )
+    event = events.get(callback.data.partition(":")[2]) or events.default()
+    await callback.message.answer(event.feedback_questions[0], reply_markup=keyboards.SCORE)
     await state.set_state(Feedback.q1)
+    await state.update_data(event=event.id)
 
 
 @dp.message(Feedback.q1)
 async def feedback_q1(message: types.Message, state: FSMContext):
     await state.update_data(q1=message.text.strip())
-    await message.answer(
-        "(2/5) Оцените выступление Екатерины Быстрых с темой "
-        "«Главные тренды: что будет с мобильными играми в 2026?»\n"
-        "(1 — совсем не понравилось, 10 — очень понравилось)"
-    )
+    event = await current_event(state)
+    await message.answer(event.feedback_questions[1])
     await state.set_state(Feedback.q2)
 
 
 @dp.message(Feedback.q2)
 async def feedback_q2(message: types.Message, state: FSMContext):
     await state.update_data(q2=message.text.strip())
-    await message.answer(
-        "(3/5) Оцените выступление Максима Мишанского с темой "
-        "«Топ ошибок продакт-менеджера в геймдеве, которые стоят времени и денег»\n"
-        "(1 — совсем не понравилось, 10 — очень понравилось)"
-    )
+    event = await current_event(state)
+    await message.answer(event.feedback_questions[2])
     await state.set_state(Feedback.q3)
 
 
 @dp.message(Feedback.q3)
 async def feedback_q3(message: types.Message, state: FSMContext):
     await state.update_data(q3=message.text.strip())
-    await message.answer(
-        "(4/5) Оцените организацию мероприятия и работу ивент-команды\n"
-        "(1 — совсем не понравилась, 10 — очень понравилась)"
-    )
+    event = await current_event(state)
+    await message.answer(event.feedback_questions[3])
     await state.set_state(Feedback.q4)
 
 
 @dp.message(Feedback.q4)
 async def feedback_q4(message: types.Message, state: FSMContext):
     await state.update_data(q4=message.text.strip())
-    await message.answer(
-        "(5/5) Если у вас есть комментарии, замечания или предложения — будем рады вашему мнению. Можете поставить прочерк.",
-        reply_markup=ReplyKeyboardRemove()
-    )
+    event = await current_event(state)
+    await message.answer(event.feedback_questions[4], reply_markup=keyboards.REMOVE)
     await state.set_state(Feedback.q5)
 
 
 @dp.message(Feedback.q5)
 async def feedback_finish(message: types.Message, state: FSMContext):
     await state.update_data(q5=message.text.strip())
+    event = await current_event(state)
     data = await state.get_data()
-    try:
-        client = get_gspread_client()
-        if client:
-            sheet = client.open(SHEET_NAME).get_worksheet(0)
-            cell = sheet.find(str(message.from_user.id))
-            if cell:
-                row = cell.row
-                sheet.update_cell(row, 11, data.get("q1", ""))
-                sheet.update_cell(row, 12, data.get("q2", ""))
-                sheet.update_cell(row, 13, data.get("q3", ""))
-                sheet.update_cell(row, 14, data.get("q4", ""))
-                sheet.update_cell(row, 15, data.get("q5", ""))
-    except Exception as e:
-        logging.error(f"Feedback write error: {e}")
+    answers = [data.get(q, "") for q in ("q1", "q2", "q3", "q4", "q5")]
+    event.attendees.set_feedback(message.from_user.id, answers)
     await message.answer("Спасибо за ваши ответы! Это поможет нам стать лучше. 💙")
     await state.clear()
 
@@ -476,27 +451,284 @@ async def feedback_decline(callback: types.CallbackQuery):
 # --- ЗАПУСК ---
 
 
+CAMPAIGNS = {
+    "reminder_24h": send_reminder_24h,
+    "reminder_3h": send_reminder_3h,
+    "feedback_request": send_feedback_request,
+    "photos_link": send_photos_link,
+}
+
+
+# Идущие плановые рассылки лидера (из планировщика и resume_campaigns):
+# при потере аренды их отменяет stop_background
+campaign_tasks = set()
+
+
+async def run_campaign(event_id: str, name: str):
+    event = events.get(event_id)
+    if event is None:
+        logging.error(f"Unknown event {event_id} for campaign {name}")
+        return
+    task = asyncio.current_task()
+    campaign_tasks.add(task)
+    try:
+        await CAMPAIGNS[name](event)
+    finally:
+        campaign_tasks.discard(task)
+
+
+def schedule_events():
+    # Задачи лежат в SQLite и переживают рестарт. Пропущенные, пока бот
+    # лежал, запускаются при старте, если опоздание меньше MISFIRE_GRACE.
+    # Уже прошедшие заново не добавляем, чтобы не отправить повторно.
+    now = datetime.now(BELGRADE_TZ)
+    job_ids = set()
+    for event in events:
+        for name, run_at in event.schedule.items():
+            if name not in CAMPAIGNS:
+                continue
+            job_id = f"{event.id}:{name}"
+            job_ids.add(job_id)
+            if run_at < now:
+                continue
+            scheduler.add_job(
+                run_campaign,
+                "date",
+                run_date=run_at,
+                args=[event.id, name],
+                id=job_id,
+                replace_existing=True,
+            )
+
+    # Убираем задачи событий, которых больше нет в конфиге
+    for job in scheduler.get_jobs():
+        if job.id not in job_ids:
+            logging.info(f"Removing stale job {job.id}")
+            job.remove()
+
+
+def resume_campaigns():
+    # Досылаем рассылки, прерванные рестартом, в том же окне MISFIRE_GRACE,
+    # что и у планировщика: напоминание «за 3 часа» после начала митапа
+    # уже не нужно. Просроченные, ручные (текст не сохраняется) и рассылки
+    # удаленных событий закрываем, чтобы не проверять их при каждом старте.
+    now = datetime.now(BELGRADE_TZ)
+    for campaign in broadcaster.log.unfinished():
+        event_id, _, name = campaign.rpartition(":")
+        event = events.get(event_id)
+        run_at = event.schedule.get(name) if event and name in CAMPAIGNS else None
+        if run_at is None or (now - run_at).total_seconds() > MISFIRE_GRACE:
+            logging.info(f"Dropping interrupted campaign {campaign}")
+            broadcaster.log.finish(campaign)
+            continue
+        logging.info(f"Resuming campaign {campaign}")
+        asyncio.create_task(run_campaign(event_id, name))
+
+
 async def handle_hc(request):
     return web.Response(text="OK")
 
 
-async def main():
+async def handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def handle_stats(request):
+    if not STATS_TOKEN:
+        raise web.HTTPForbidden()
+    if request.query.get("token") != STATS_TOKEN:
+        raise web.HTTPUnauthorized()
+    event_id = request.match_info.get("event_id")
+    event = events.get(event_id) if event_id else events.default()
+    if event is None:
+        raise web.HTTPNotFound()
+    return web.json_response(event_report(event), dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+
+async def handle_calendar(request):
+    # Календари опрашивают ссылку регулярно: отвечаем 304 по ETag или
+    # Last-Modified, тело собрано заранее при загрузке событий
+    event = events.get(request.match_info["event_id"])
+    if event is None:
+        raise web.HTTPNotFound()
+    calendar = event.calendar
+    headers = {
+        "ETag": calendar.etag,
+        "Last-Modified": calendar.last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+        "Cache-Control": "public, max-age=3600",
+    }
+    if calendar.not_modified(request.headers.get("If-None-Match"), request.if_modified_since):
+        return web.Response(status=304, headers=headers)
+    return web.Response(
+        body=calendar.body,
+        content_type="text/calendar",
+        charset="utf-8",
+        headers={**headers, "Content-Disposition": f'inline; filename="{event.id}.ics"'},
+    )
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    # Не больше max_in_flight апдейтов обрабатываются одновременно.
+    # Пока слотов нет, Telegram ждет ответа, и очередь копится у него,
+    # а не в памяти процесса.
+
+    def __init__(self, *args, max_in_flight: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except Exception:
+            self._slots.release()
+            raise
+
+    async def _background_feed_update(self, bot: Bot, update: dict) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self._slots.release()
+
+
+async def import_attendees():
+    # Разовый импорт участников из таблицы для новых событий. Пока Sheets
+    # недоступен, повторяем в фоне; бот тем временем работает по Store.
+    pending = events.upcoming()
+    while True:
+        pending = [event for event in pending if not await event.attendees.ensure_imported()]
+        if not pending:
+            return
+        await asyncio.sleep(IMPORT_RETRY)
+
+
+importer = None
+
+
+async def start_background():
+    # Планировщик задач и зеркало в Sheets: в одном экземпляре на весь бот
+    scheduler.start()
+    schedule_events()
+    global importer
+    importer = asyncio.create_task(import_attendees())
+    mirror.start()
+    resume_campaigns()
+
+
+async def stop_background():
+    if importer is not None:
+        importer.cancel()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    # Недосланное продолжит resume_campaigns нового лидера
+    for task in list(campaign_tasks):
+        task.cancel()
+    await asyncio.gather(*campaign_tasks, return_exceptions=True)
+    await mirror.stop()
+
+
+def create_app():
     app = web.Application()
     app.router.add_get("/", handle_hc)
-    runner = web.AppRunner(app)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/stats/{event_id}", handle_stats)
+    app.router.add_get("/calendar/{event_id}.ics", handle_calendar)
+    return app
+
+
+async def start_app(app, host: str, port: int, **kwargs):
+    runner = web.AppRunner(app, **kwargs)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", int(os.getenv("PORT", 10000)))
-    asyncio.create_task(site.start())
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def set_webhook():
+    if not WEBHOOK_SECRET:
+        logging.warning("WEBHOOK_SECRET is not set, webhook requests are not verified")
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=min(WEBHOOK_MAX_HANDLERS, 100),
+        allowed_updates=dp.resolve_used_update_types(),
+    )
 
-    # Планировщик задач
-    scheduler.add_job(send_reminder_24h, "cron", year=2026, month=2, day=25, hour=15, minute=0)
-    scheduler.add_job(send_reminder_3h, "cron", year=2026, month=2, day=26, hour=15, minute=0)
-    scheduler.add_job(send_feedback_request, "cron", year=2026, month=2, day=27, hour=11, minute=0)
-    scheduler.add_job(send_photos_link, "cron", year=2026, month=3, day=2, hour=16, minute=0)
 
-    scheduler.start()
-    await dp.start_polling(bot)
+def stop_on_sigterm():
+    # SIGTERM отменяет main, чтобы отработали finally: воркеры
+    # досылают изменения в Sheets и отпускают аренду лидера
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+
+async def run_front():
+    # Фронт не обрабатывает апдейты сам, только раздает их воркерам
+    stop_on_sigterm()
+    front = cluster.Front(WORKERS, WORKER_PORT, WEBHOOK_MAX_HANDLERS)
+    app = create_app()
+    if WEBHOOK_URL:
+        app.router.add_post(WEBHOOK_PATH, front.webhook_handler(WEBHOOK_SECRET))
+    runner = await start_app(app, "0.0.0.0", int(os.getenv("PORT", 10000)))
+    supervisor = asyncio.create_task(front.supervise())
+    try:
+        if WEBHOOK_URL:
+            await set_webhook()
+            await supervisor
+        else:
+            await bot.delete_webhook()
+            await front.poll(bot, dp.resolve_used_update_types())
+    finally:
+        supervisor.cancel()
+        await asyncio.gather(supervisor, return_exceptions=True)
+        await front.close()
+        await bot.session.close()
+        await runner.cleanup()
+
+
+async def run_worker(index: int):
+    # Воркер обрабатывает свой шард апдейтов; фоновые задачи — только у лидера
+    stop_on_sigterm()
+    runner = await start_app(cluster.worker_app(dp, bot), "127.0.0.1", WORKER_PORT + index, access_log=None)
+    lease = cluster.Lease(DB_PATH, "leader", owner=f"worker-{index}-{os.getpid()}")
+    try:
+        await lease.hold(start_background, stop_background)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+async def main():
+    if WORKER_INDEX is not None:
+        return await run_worker(int(WORKER_INDEX))
+    if WORKERS > 1:
+        return await run_front()
+
+    app = create_app()
+    if WEBHOOK_URL:
+        LimitedRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=WEBHOOK_SECRET,
+            max_in_flight=WEBHOOK_MAX_HANDLERS,
+        ).register(app, path=WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    runner = await start_app(app, "0.0.0.0", int(os.getenv("PORT", 10000)))
+
+    await start_background()
+    try:
+        if WEBHOOK_URL:
+            await set_webhook()
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await stop_background()
+        await runner.cleanup()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        logging.info("Stopped")
\ No newline at end of file
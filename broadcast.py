@@ -0,0 +1,296 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+
+import metrics
+
+# Глобальный лимит Telegram ~30 сообщений/с, оставляем запас
+RATE_LIMIT = float(os.getenv("BROADCAST_RATE", 25))
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", 3))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # RetryAfter относится ко всему боту, а не к одному чату
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class SharedTokenBucket:
+    # Тот же лимит, но общий для всех процессов (режим WORKERS > 1):
+    # каждый acquire резервирует следующий слот в SQLite, так что
+    # воркеры вместе не превышают rate сообщений в секунду.
+
+    def __init__(self, path: str, rate: float, name: str = "telegram"):
+        self.name = name
+        self.interval = 1 / rate
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                next_at REAL NOT NULL,
+                paused_until REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self.db.execute("INSERT OR IGNORE INTO rate_limits (name, next_at) VALUES (?, 0)", (name,))
+        self.db.commit()
+
+    def _reserve(self, now: float) -> float:
+        (next_at,) = self.db.execute(
+            "UPDATE rate_limits SET next_at = max(next_at, paused_until, ?) + ? WHERE name = ? RETURNING next_at",
+            (now, self.interval, self.name),
+        ).fetchone()
+        self.db.commit()
+        return next_at - self.interval
+
+    def _paused_until(self) -> float:
+        return self.db.execute("SELECT paused_until FROM rate_limits WHERE name = ?", (self.name,)).fetchone()[0]
+
+    async def acquire(self):
+        while True:
+            now = time.time()
+            slot = self._reserve(now)
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # Пока ждали, кто-то мог получить RetryAfter — тогда берем новый слот
+            if time.time() >= self._paused_until():
+                return
+
+    def pause(self, seconds: float):
+        self.db.execute(
+            "UPDATE rate_limits SET paused_until = max(paused_until, ?) WHERE name = ?",
+            (time.time() + seconds, self.name),
+        )
+        self.db.commit()
+
+
+class DeliveryLog:
+    # Состояние доставки по каждому получателю в SQLite.
+    # sending — отправка начата, но не подтверждена; при возобновлении
+    # такие получатели пропускаются, чтобы не было дублей.
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS campaigns (
+                campaign TEXT PRIMARY KEY,
+                started_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS deliveries (
+                campaign TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (campaign, chat_id)
+            );
+            CREATE INDEX IF NOT EXISTS deliveries_status ON deliveries (status);
+            """
+        )
+        self.db.commit()
+
+    def start(self, campaign: str):
+        self.db.execute(
+            "INSERT OR IGNORE INTO campaigns (campaign, started_at) VALUES (?, ?)",
+            (campaign, time.time()),
+        )
+        self.db.execute("UPDATE campaigns SET finished_at = NULL WHERE campaign = ?", (campaign,))
+        self.db.commit()
+
+    def finish(self, campaign: str):
+        self.db.execute("UPDATE campaigns SET finished_at = ? WHERE campaign = ?", (time.time(), campaign))
+        self.db.commit()
+
+    def unfinished(self):
+        rows = self.db.execute("SELECT campaign FROM campaigns WHERE finished_at IS NULL")
+        return [row[0] for row in rows]
+
+    def done(self, campaign: str):
+        rows = self.db.execute(
+            "SELECT chat_id FROM deliveries WHERE campaign = ? AND status != 'failed'",
+            (campaign,),
+        )
+        return {row[0] for row in rows}
+
+    def blocked(self):
+        rows = self.db.execute("SELECT DISTINCT chat_id FROM deliveries WHERE status = 'blocked'")
+        return {row[0] for row in rows}
+
+    def unblock(self, chat_id: int):
+        # Пользователь снова пишет боту: blocked остается в истории
+        # рассылок, но больше не исключает его из следующих
+        self.db.execute(
+            "UPDATE deliveries SET status = 'unblocked', updated_at = ? WHERE status = 'blocked' AND chat_id = ?",
+            (time.time(), chat_id),
+        )
+        self.db.commit()
+
+    def claim(self, campaign: str, chat_id: int) -> bool:
+        # Атомарно берет получателя: False, если ему уже отправляют или
+        # отправили (в том числе другой процесс). Повторно можно взять
+        # только после failed — то же условие, что и в done.
+        cursor = self.db.execute(
+            """
+            INSERT INTO deliveries (campaign, chat_id, status, updated_at) VALUES (?, ?, 'sending', ?)
+            ON CONFLICT (campaign, chat_id) DO UPDATE SET status = 'sending', updated_at = excluded.updated_at
+            WHERE deliveries.status = 'failed'
+            """,
+            (campaign, chat_id, time.time()),
+        )
+        self.db.commit()
+        return cursor.rowcount > 0
+
+    def mark(self, campaign: str, chat_id: int, status: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO deliveries (campaign, chat_id, status, updated_at) VALUES (?, ?, ?, ?)",
+            (campaign, chat_id, status, time.time()),
+        )
+        self.db.commit()
+
+
+class BroadcastResult:
+    __slots__ = ("sent", "failed", "throttled", "blocked", "skipped")
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.blocked = 0
+        self.skipped = 0
+
+    def __str__(self):
+        return (
+            f"sent={self.sent} failed={self.failed} "
+            f"throttled={self.throttled} blocked={self.blocked} skipped={self.skipped}"
+        )
+
+
+class Broadcaster:
+    def __init__(self, bot, log: DeliveryLog = None, rate: float = RATE_LIMIT, concurrency: int = CONCURRENCY,
+                 bucket=None):
+        self.bot = bot
+        self.log = log
+        self.bucket = bucket or TokenBucket(rate)
+        self.concurrency = concurrency
+        # Пользователи, заблокировавшие бота: им больше не пишем
+        self.blocked = log.blocked() if log else set()
+        self._running = set()
+
+    def unblock(self, chat_id: int):
+        self.blocked.discard(chat_id)
+        if self.log:
+            self.log.unblock(chat_id)
+
+    def _mark(self, campaign, chat_id, status):
+        metrics.broadcast_deliveries.inc(campaign or "", status)
+        if self.log and campaign:
+            self.log.mark(campaign, chat_id, status)
+
+    async def _deliver(self, campaign, chat_id: int, text, kwargs: dict, result: BroadcastResult):
+        if self.log and campaign and not self.log.claim(campaign, chat_id):
+            # done читается один раз при старте; за это время получателя
+            # мог взять другой процесс (например, новый лидер)
+            result.skipped += 1
+            return
+        if callable(text):
+            text = text(chat_id)
+        for _ in range(MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                result.sent += 1
+                self._mark(campaign, chat_id, "sent")
+                return
+            except TelegramRetryAfter as e:
+                result.throttled += 1
+                metrics.telegram_retry_after.inc()
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                self.blocked.add(chat_id)
+                result.blocked += 1
+                self._mark(campaign, chat_id, "blocked")
+                return
+            except Exception as e:
+                logging.error(f"Broadcast error for {chat_id}: {e}")
+                result.failed += 1
+                self._mark(campaign, chat_id, "failed")
+                return
+        logging.error(f"Broadcast gave up on {chat_id} after {MAX_ATTEMPTS} attempts")
+        result.failed += 1
+        self._mark(campaign, chat_id, "failed")
+
+    async def send(self, chat_ids, text, campaign: str = None, **kwargs) -> BroadcastResult:
+        # С campaign рассылка идемпотентна: повторный запуск (в том числе
+        # после рестарта) досылает только тем, кому еще не отправляли.
+        # text — готовая строка для всех или функция chat_id -> str
+        # для персональных сообщений (например, Template.render).
+        result = BroadcastResult()
+        if campaign in self._running:
+            # Та же рассылка уже идет (например, догон после рестарта)
+            logging.warning(f"Campaign {campaign} is already running")
+            return result
+        done = set()
+        if self.log:
+            # Список мог пополниться в других процессах
+            self.blocked = self.log.blocked()
+        if self.log and campaign:
+            self.log.start(campaign)
+            done = self.log.done(campaign)
+
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            if chat_id in self.blocked or chat_id in done:
+                result.skipped += 1
+                continue
+            queue.put_nowait(chat_id)
+
+        async def worker():
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._deliver(campaign, chat_id, text, kwargs, result)
+
+        if campaign:
+            self._running.add(campaign)
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            self._running.discard(campaign)
+        if self.log and campaign:
+            self.log.finish(campaign)
+        return result
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import sqlite3
+import subprocess
+
+import aiohttp
+from aiohttp import web
+
+# Режим нескольких процессов (WORKERS > 1). Главный процесс — фронт:
+# принимает апдейты (вебхук или getUpdates) и раздает их воркерам по
+# user_id, так что FSM и кэши одного пользователя живут в одном процессе.
+# Воркеры делят SQLite-файл DB_PATH: FSM, участников, журнал рассылок и
+# задачи планировщика. Планировщик и зеркало в Sheets крутит только
+# лидер — воркер, который держит аренду в таблице leases.
+
+LEASE_TTL = float(os.getenv("LEASE_TTL", 30))
+FORWARD_ATTEMPTS = 5
+
+
+def shard_of(update: dict, workers: int) -> int:
+    # Апдейты без пользователя (например, опросы) уходят нулевому воркеру
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user") or value.get("chat")
+            if isinstance(user, dict) and "id" in user:
+                return user["id"] % workers
+    return 0
+
+
+class Lease:
+    # Аренда с истечением: продлить может только владелец, забрать
+    # чужую — только после expires_at. Лидер продлевает ее каждые ttl/3.
+
+    def __init__(self, path: str, name: str, owner: str, ttl: float = LEASE_TTL):
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+
+    def acquire(self) -> bool:
+        now = time.time()
+        self.db.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """,
+            (self.name, self.owner, now + self.ttl, now),
+        )
+        self.db.commit()
+        row = self.db.execute("SELECT owner FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return row is not None and row[0] == self.owner
+
+    def release(self):
+        self.db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, self.owner))
+        self.db.commit()
+
+    async def hold(self, on_acquire, on_lose):
+        # Бесконечный цикл: при получении аренды вызывает on_acquire,
+        # при потере — on_lose (оба — корутины)
+        leading = False
+        try:
+            while True:
+                try:
+                    acquired = self.acquire()
+                except sqlite3.Error as e:
+                    logging.error(f"Lease {self.name} error: {e}")
+                    acquired = False
+                if acquired and not leading:
+                    logging.info(f"{self.owner} is now the leader")
+                    leading = True
+                    await on_acquire()
+                elif leading and not acquired:
+                    logging.warning(f"{self.owner} lost the leader lease")
+                    leading = False
+                    await on_lose()
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            if leading:
+                await on_lose()
+                self.release()
+
+
+class Front:
+    # Раздача апдейтов воркерам. Воркер i слушает 127.0.0.1:port + i и
+    # отвечает, когда апдейт обработан, поэтому очередь копится у Telegram.
+
+    def __init__(self, workers: int, port: int, max_in_flight: int):
+        self.workers = workers
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._processes = []
+        self._session = None
+
+    # --- процессы ---
+
+    def _spawn(self, index: int):
+        env = dict(os.environ, WORKER_INDEX=str(index))
+        return subprocess.Popen([sys.executable, sys.argv[0]], env=env)
+
+    async def supervise(self):
+        # Упавший воркер перезапускаем, его шард ждет в FORWARD_ATTEMPTS
+        self._processes = [self._spawn(i) for i in range(self.workers)]
+        try:
+            while True:
+                await asyncio.sleep(1)
+                for index, process in enumerate(self._processes):
+                    if process.poll() is not None:
+                        logging.error(f"Worker {index} exited with {process.returncode}, restarting")
+                        self._processes[index] = self._spawn(index)
+        finally:
+            for process in self._processes:
+                process.terminate()
+            for process in self._processes:
+                process.wait()
+
+    # --- пересылка ---
+
+    async def forward(self, update: dict) -> int:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        shard = shard_of(update, self.workers)
+        url = f"http://127.0.0.1:{self.port + shard}/update"
+        async with self._slots:
+            for attempt in range(FORWARD_ATTEMPTS):
+                try:
+                    async with self._session.post(url, json=update) as response:
+                        return response.status
+                except aiohttp.ClientError as e:
+                    logging.warning(f"Worker {shard} is unavailable ({e}), attempt {attempt + 1}")
+                    await asyncio.sleep(2 ** attempt)
+        logging.error(f"Update {update.get('update_id')} dropped: worker {shard} is down")
+        return 503
+
+    def webhook_handler(self, secret: str):
+        async def handle(request: web.Request):
+            if secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                return web.Response(status=401)
+            # 5xx — воркер недоступен, Telegram доставит апдейт повторно
+            status = await self.forward(await request.json())
+            return web.Response(status=status if status >= 500 else 200)
+
+        return handle
+
+    async def poll(self, bot, allowed_updates):
+        # getUpdates сырыми JSON, чтобы не разбирать и не собирать Update заново
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        url = bot.session.api.api_url(bot.token, "getUpdates")
+        offset = 0
+        tasks = set()
+        while True:
+            # Не забираем новые апдейты, пока воркеры не разгребли текущие
+            while len(tasks) >= self.max_in_flight:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            params = {"offset": offset, "timeout": 30, "allowed_updates": allowed_updates}
+            try:
+                async with self._session.post(url, json=params, timeout=aiohttp.ClientTimeout(total=60)) as response:
+                    reply = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.error(f"getUpdates error: {e}")
+                await asyncio.sleep(5)
+                continue
+            if not reply.get("ok"):
+                # 409 (другой getUpdates или вебхук), 401, 429 — ждем, а не долбим API
+                retry_after = reply.get("parameters", {}).get("retry_after", 5)
+                logging.error(f"getUpdates failed: {reply.get('error_code')} {reply.get('description')}")
+                await asyncio.sleep(retry_after)
+                continue
+            updates = reply["result"]
+            for update in updates:
+                offset = update["update_id"] + 1
+                task = asyncio.create_task(self.forward(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def worker_app(dispatcher, bot) -> web.Application:
+    async def handle_update(request: web.Request):
+        # Ошибка хендлера не повод для повторной доставки: как и в обычном
+        # режиме, апдейт логируется и считается обработанным
+        try:
+            await dispatcher.feed_raw_update(bot, await request.json())
+        except Exception:
+            logging.exception("Update handling failed")
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post("/update", handle_update)
+    return app
@@ -0,0 +1,165 @@
+import os
+import html
+import json
+from string import Formatter
+from datetime import datetime, timedelta
+
+from pytz import timezone, utc
+
+import ics
+
+from attendees import Attendees
+from store import FIELDS
+
+DEFAULT_TZ = "Europe/Belgrade"
+# Внешний адрес бота, по которому календари отдаются в /calendar/<id>.ics
+PUBLIC_URL = os.getenv("PUBLIC_URL") or os.getenv("WEBHOOK_URL")
+
+_formatter = Formatter()
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class Template:
+    # Текст сообщения, скомпилированный один раз при загрузке события:
+    # поля {event.*} подставляются сразу, остаются только персональные
+    # вроде {full_name}. Если их нет, render отдает готовую строку.
+
+    def __init__(self, source: str, **context):
+        parts = []
+        self.fields = set()
+        for literal, field, spec, conversion in _formatter.parse(source):
+            parts.append(_escape(literal))
+            if field is None:
+                continue
+            root = field.split(".")[0].split("[")[0]
+            if root in context:
+                value = _formatter.convert_field(_formatter.get_field(field, (), context)[0], conversion)
+                parts.append(_escape(format(value, spec)))
+            else:
+                self.fields.add(root)
+                parts.append(
+                    "{" + field + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}"
+                )
+        self.source = "".join(parts)
+        self.text = None if self.fields else self.source.format()
+
+    def render(self, **kwargs) -> str:
+        if self.text is not None:
+            return self.text
+        return self.source.format(**kwargs)
+
+
+class Event:
+    def __init__(self, config: dict, store, modified_at: datetime = None):
+        self.id = config["id"]
+        self.title = config["title"]
+        self.tz = timezone(config.get("timezone", DEFAULT_TZ))
+        self.starts_at = self.tz.localize(datetime.fromisoformat(config["starts_at"]))
+        self.ends_at = self.tz.localize(datetime.fromisoformat(config["ends_at"]))
+        self.venue = config.get("venue", "")
+        self.summary = config.get("summary", self.title)
+        self.location = config.get("location", self.venue)
+        self.description = config.get("description", "")
+        self.maps_url = config.get("maps_url", "")
+        self.photo_link = config.get("photo_link", "")
+        self.worksheet = config.get("worksheet", 0)
+        self.messages = config["messages"]
+        self.feedback_questions = config["feedback_questions"]
+        # Время рассылок задается смещением от начала события
+        self.schedule = {
+            name: self.starts_at + timedelta(**offset)
+            for name, offset in config.get("schedule", {}).items()
+        }
+        self.attendees = Attendees(store, self.id, self.worksheet)
+        self.templates = {name: Template(text, event=self) for name, text in self.messages.items()}
+        # Персональные поля — только колонки участника: опечатка в
+        # events.json должна падать при загрузке, а не в задаче рассылки
+        for name, template in self.templates.items():
+            unknown = template.fields - set(FIELDS)
+            if unknown:
+                raise ValueError(f"Event {self.id!r}, message {name!r}: unknown fields {', '.join(sorted(unknown))}")
+        # .ics собирается из этого же конфига; ссылки из конфига или
+        # окружения остаются только как запасной вариант
+        self.calendar = ics.CalendarFile(self, modified_at or datetime.now(utc))
+        self.calendar_url = f"{PUBLIC_URL.rstrip('/')}/calendar/{self.id}.ics" if PUBLIC_URL else None
+        self.google_cal_url = config.get("google_cal_url") or ics.google_link(self)
+        self.apple_cal_url = config.get("apple_cal_url") or self.calendar_url or os.getenv("APPLE_CAL_URL")
+
+    def text(self, name: str, **kwargs) -> str:
+        return self.templates[name].render(**kwargs)
+
+    def broadcast_text(self, name: str, escape: bool = False):
+        # Для Broadcaster.send: готовая строка или, если в шаблоне есть
+        # поля участника вроде {full_name}, функция chat_id -> str.
+        # escape — для parse_mode="HTML": имя вводит сам пользователь
+        template = self.templates[name]
+        if not template.fields:
+            return template.text
+
+        def render(chat_id: int) -> str:
+            attendee = self.attendees.get(chat_id)
+            values = {field: str(getattr(attendee, field, None) or "") for field in FIELDS}
+            values["full_name"] = values["full_name"] or "Участник"
+            if escape:
+                values = {field: html.escape(value) for field, value in values.items()}
+            return template.render(**values)
+
+        return render
+
+
+class EventRegistry:
+    def __init__(self, events):
+        # У каждого события свой лист: на общем листе импорт, зеркало и
+        # индекс строк смешали бы участников разных событий
+        self.events = {}
+        worksheets = {}
+        for event in sorted(events, key=lambda e: e.starts_at):
+            if event.id in self.events:
+                raise ValueError(f"Duplicate event id {event.id!r}")
+            if event.worksheet in worksheets:
+                raise ValueError(
+                    f"Events {worksheets[event.worksheet]!r} and {event.id!r} share worksheet {event.worksheet!r}"
+                )
+            self.events[event.id] = event
+            worksheets[event.worksheet] = event.id
+
+    @classmethod
+    def load(cls, path: str, store):
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        # Время правки файла — Last-Modified для календарей, одинаковое
+        # во всех процессах
+        modified_at = datetime.fromtimestamp(os.path.getmtime(path), utc)
+        if len(config["events"]) > 1:
+            for item in config["events"]:
+                if "worksheet" not in item:
+                    raise ValueError(f"Event {item['id']!r}: worksheet is required when there are several events")
+        return cls(Event(item, store, modified_at) for item in config["events"])
+
+    def __iter__(self):
+        return iter(self.events.values())
+
+    def get(self, event_id):
+        return self.events.get(event_id)
+
+    def upcoming(self):
+        # События, которые еще не закончились, ближайшие первыми
+        now = datetime.now(timezone("UTC"))
+        return [event for event in self if event.ends_at > now]
+
+    def default(self):
+        # Регистрация без deep-link попадает на ближайшее событие
+        upcoming = self.upcoming()
+        if upcoming:
+            return upcoming[0]
+        return list(self)[-1]
+
+    def find_for_user(self, user_id: int):
+        # Ближайшее незавершенное событие, на которое пользователь записан
+        for event in self.upcoming():
+            if event.attendees.get(user_id):
+                return event
+        return None
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+# Незавершенные регистрации и опросы живут неделю
+FSM_TTL = int(os.getenv("FSM_TTL", 7 * 24 * 3600))
+CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+PURGE_INTERVAL = 600
+
+
+class SQLiteStorage(BaseStorage):
+    # FSM в SQLite: переживает рестарты и редеплой.
+    # Горячие записи держим в LRU-кэше ограниченного размера,
+    # запись идет сквозь кэш сразу в базу.
+
+    def __init__(self, path: str, ttl: int = FSM_TTL, cache_size: int = CACHE_SIZE):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._purged_at = 0.0
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at);
+            """
+        )
+        self.db.commit()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id, key.destiny]
+        return ":".join("" if part is None else str(part) for part in parts)
+
+    def _load(self, key: str):
+        record = self._cache.get(key)
+        if record is None:
+            row = self.db.execute(
+                "SELECT state, data, expires_at FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+            record = (row[0], json.loads(row[1]), row[2]) if row else (None, {}, 0.0)
+        if record[2] and record[2] < time.time():
+            record = (None, {}, 0.0)
+        self._remember(key, record)
+        return record
+
+    def _remember(self, key: str, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _save(self, key: str, state, data: dict):
+        now = time.time()
+        if state is None and not data:
+            # Пустые записи не храним, чтобы база не росла
+            self.db.execute("DELETE FROM fsm WHERE key = ?", (key,))
+            self._remember(key, (None, {}, 0.0))
+        else:
+            expires_at = now + self.ttl
+            self.db.execute(
+                "INSERT OR REPLACE INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+                (key, state, json.dumps(data, ensure_ascii=False), expires_at),
+            )
+            self._remember(key, (state, data, expires_at))
+        if now - self._purged_at > PURGE_INTERVAL:
+            self.db.execute("DELETE FROM fsm WHERE expires_at < ?", (now,))
+            self._purged_at = now
+        self.db.commit()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        key = self._key(key)
+        _, data, _ = self._load(key)
+        self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        return self._load(self._key(key))[0]
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        key = self._key(key)
+        state, _, _ = self._load(key)
+        self._save(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return self._load(self._key(key))[1].copy()
+
+    async def close(self) -> None:
+        self.db.close()
+
+
+def create_storage(url: str) -> BaseStorage:
+    # redis://... — общий Redis (нужен пакет redis), иначе путь к SQLite
+    if url.startswith(("redis://", "rediss://")):
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(url, state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+    return SQLiteStorage(url)
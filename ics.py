@@ -0,0 +1,136 @@
+import hashlib
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from pytz import utc
+
+# Генерация .ics (RFC 5545) из конфига события. VTIMEZONE строится из
+# таблицы переходов pytz — явными переходами вокруг дат события, без RRULE.
+
+PRODID = "-//G5 Games//Meetup Bot//RU"
+
+
+def _escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    # Строки длиннее 75 октетов переносятся, продолжение начинается с пробела
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(data))
+        # Не режем многобайтовый символ UTF-8 пополам
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+    return "\r\n ".join(parts)
+
+
+def _offset(delta: timedelta) -> str:
+    minutes = int(delta.total_seconds()) // 60
+    sign = "+" if minutes >= 0 else "-"
+    return f"{sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}"
+
+
+def _local(moment: datetime) -> str:
+    return moment.strftime("%Y%m%dT%H%M%S")
+
+
+def vtimezone(tz, start: datetime, end: datetime):
+    zone = str(tz)
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{zone}"]
+    transitions = getattr(tz, "_utc_transition_times", None)
+    if not transitions:
+        # Зона без переходов (UTC и т. п.)
+        offset = _offset(tz.utcoffset(datetime(1970, 1, 1)))
+        lines += [
+            "BEGIN:STANDARD", "DTSTART:19700101T000000",
+            f"TZOFFSETFROM:{offset}", f"TZOFFSETTO:{offset}", "END:STANDARD",
+        ]
+    else:
+        info = tz._transition_info
+        # Переходы с начала года до события по конец года после него,
+        # плюс последний переход перед этим окном
+        first = max(1, bisect_right(transitions, datetime(start.year - 1, 1, 1)) - 1)
+        last = bisect_right(transitions, datetime(end.year + 1, 12, 31))
+        for i in range(first, last):
+            before, after = info[i - 1][0], info[i]
+            kind = "DAYLIGHT" if after[1] else "STANDARD"
+            lines += [
+                f"BEGIN:{kind}",
+                f"TZNAME:{after[2]}",
+                f"DTSTART:{_local(transitions[i] + before)}",
+                f"TZOFFSETFROM:{_offset(before)}",
+                f"TZOFFSETTO:{_offset(after[0])}",
+                f"END:{kind}",
+            ]
+    lines.append("END:VTIMEZONE")
+    return lines
+
+
+def build(event, modified_at: datetime) -> str:
+    zone = str(event.tz)
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        *vtimezone(event.tz, event.starts_at, event.ends_at),
+        "BEGIN:VEVENT",
+        f"UID:{event.id}@g5-meetup-bot",
+        f"DTSTAMP:{modified_at.astimezone(utc).strftime('%Y%m%dT%H%M%SZ')}",
+        f"LAST-MODIFIED:{modified_at.astimezone(utc).strftime('%Y%m%dT%H%M%SZ')}",
+        f"SUMMARY:{_escape(event.summary)}",
+        f"DTSTART;TZID={zone}:{_local(event.starts_at)}",
+        f"DTEND;TZID={zone}:{_local(event.ends_at)}",
+    ]
+    if event.location:
+        lines.append(f"LOCATION:{_escape(event.location)}")
+    if event.description:
+        lines.append(f"DESCRIPTION:{_escape(event.description)}")
+    if event.maps_url:
+        lines.append(f"URL:{event.maps_url}")
+    lines += ["END:VEVENT", "END:VCALENDAR"]
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+def google_link(event) -> str:
+    # Ссылка «добавить в Google Календарь» с теми же данными, что и .ics
+    params = {
+        "action": "TEMPLATE",
+        "text": event.summary,
+        "dates": f"{_local(event.starts_at)}/{_local(event.ends_at)}",
+        "ctz": str(event.tz),
+        "location": event.location,
+    }
+    return "https://calendar.google.com/calendar/render?" + urlencode(params)
+
+
+class CalendarFile:
+    # Готовый .ics одного события. Собирается один раз; ETag — хэш
+    # содержимого, поэтому одинаков во всех процессах и меняется
+    # только вместе с событием.
+
+    def __init__(self, event, modified_at: datetime):
+        self.body = build(event, modified_at).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        # HTTP-даты с точностью до секунды
+        self.last_modified = modified_at.astimezone(utc).replace(microsecond=0)
+
+    def not_modified(self, if_none_match, if_modified_since) -> bool:
+        # If-None-Match приоритетнее If-Modified-Since (RFC 9110)
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags
+        if if_modified_since is not None:
+            return self.last_modified <= if_modified_since
+        return False
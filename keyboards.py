@@ -0,0 +1,80 @@
+from functools import lru_cache
+
+from aiogram.types import (
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    ReplyKeyboardRemove,
+)
+
+# Клавиатуры собираются один раз при импорте и переиспользуются во всех
+# ответах и рассылках. Это общие объекты — не изменять.
+
+REMOVE = ReplyKeyboardRemove()
+
+DIRECTION = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="Game Design"), KeyboardButton(text="Product / Analytics")],
+        [KeyboardButton(text="Art / Design"), KeyboardButton(text="Development")],
+        [KeyboardButton(text="Marketing"), KeyboardButton(text="QA")],
+        [KeyboardButton(text="Management / Lead"), KeyboardButton(text="HR / Recruitment")],
+        [KeyboardButton(text="Другое")],
+    ],
+    resize_keyboard=True,
+)
+
+EXPERIENCE = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="нет опыта"), KeyboardButton(text="менее 1 года")],
+        [KeyboardButton(text="1-3 года"), KeyboardButton(text="3-6 лет")],
+        [KeyboardButton(text="более 6 лет")],
+    ],
+    resize_keyboard=True,
+)
+
+YES_NO = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="Да"), KeyboardButton(text="Нет")]],
+    resize_keyboard=True,
+)
+
+SCORE = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=str(i)) for i in range(1, 6)],
+        [KeyboardButton(text=str(i)) for i in range(6, 11)],
+    ],
+    resize_keyboard=True,
+)
+
+
+# Клавиатуры, зависящие от события, кэшируются на каждое событие
+
+
+@lru_cache(maxsize=None)
+def calendar(event):
+    buttons = [("🗓 Google Календарь", event.google_cal_url), ("🍎 Apple Календарь", event.apple_cal_url)]
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text=text, url=url)] for text, url in buttons if url]
+    )
+
+
+@lru_cache(maxsize=None)
+def confirm(event):
+    # Событие едет в callback_data: ответ на напоминание меняет статус
+    # именно в нем, даже если пользователь записан на несколько
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(text="❌ Изменились планы", callback_data=f"confirm:{event.id}:Declined"),
+            InlineKeyboardButton(text="✅ Я буду!", callback_data=f"confirm:{event.id}:Coming"),
+        ]]
+    )
+
+
+@lru_cache(maxsize=None)
+def feedback_invite(event):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="Да, хочу", callback_data=f"start_feedback:{event.id}")],
+            [InlineKeyboardButton(text="Нет, спасибо", callback_data="decline_feedback")],
+        ]
+    )
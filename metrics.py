@@ -0,0 +1,132 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Метрики в текстовом формате Prometheus для /metrics.
+# Обновляются и из event loop, и из потоков Sheets, поэтому под локом.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = buckets
+        # label_values -> [счетчики по корзинам, сумма, количество]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    yield f"{self.name}_bucket{_labels(names, label_values + (bound,))} {bucket_count}"
+                yield f"{self.name}_bucket{_labels(names, label_values + ('+Inf',))} {count}"
+                yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+                yield f"{self.name}_count{_labels(self.labels, label_values)} {count}"
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+update_seconds = Histogram(
+    "bot_update_seconds", "Update handling time by FSM state", ["state"]
+)
+sheets_seconds = Histogram(
+    "bot_sheets_request_seconds", "Google Sheets API call latency", ["operation"]
+)
+sheets_errors = Counter(
+    "bot_sheets_errors_total", "Google Sheets API errors by HTTP status", ["code"]
+)
+sheets_retries = Counter(
+    "bot_sheets_retries_total", "Retried Google Sheets batch writes"
+)
+telegram_seconds = Histogram(
+    "bot_telegram_request_seconds", "Telegram Bot API call latency", ["method"]
+)
+telegram_retry_after = Counter(
+    "bot_telegram_retry_after_total", "Telegram 429 RetryAfter responses"
+)
+broadcast_deliveries = Counter(
+    "bot_broadcast_deliveries_total", "Broadcast deliveries by campaign and result", ["campaign", "result"]
+)
+updates_dropped = Counter(
+    "bot_updates_dropped_total", "Updates dropped by throttling", ["reason"]
+)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # Время обработки апдейта в разрезе FSM-состояния, в котором он пришел
+
+    async def __call__(self, handler, event, data):
+        state = data.get("raw_state") or "none"
+        with update_seconds.time(state):
+            return await handler(event, data)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        with telegram_seconds.time(method.__api_method__):
+            return await make_request(bot, method)
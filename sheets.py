@@ -0,0 +1,296 @@
+import os
+import asyncio
+import base64
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
+from google.oauth2.service_account import Credentials
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+SHEET_NAME = os.getenv("SHEET_NAME")
+SHEET_KEY = os.getenv("SHEET_KEY")
+POOL_SIZE = int(os.getenv("SHEETS_POOL_SIZE", 10))
+WORKERS = int(os.getenv("SHEETS_WORKERS", 4))
+MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", 5))
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+# Один клиент и одни открытые хэндлы на весь процесс.
+# AuthorizedSession сам обновляет токен перед истечением, поэтому
+# повторно вызывать gspread.authorize() не нужно.
+_lock = threading.Lock()
+_client = None
+_spreadsheet = None
+_worksheets = {}
+_indexes = {}
+
+# gspread синхронный: все вызовы идут в ограниченный пул потоков,
+# чтобы не блокировать event loop бота и health check
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="sheets")
+
+
+def _authorize():
+    encoded_json = os.getenv("SERVICE_ACCOUNT_B64")
+    if not encoded_json:
+        logging.error("SERVICE_ACCOUNT_B64 is not set")
+        return None
+
+    decoded_json = json.loads(base64.b64decode(encoded_json.strip()))
+    creds = Credentials.from_service_account_info(decoded_json, scopes=SCOPES)
+    client = gspread.authorize(creds)
+
+    # Общий пул keep-alive соединений для всех обработчиков
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    client.http_client.session.mount("https://", adapter)
+    return client
+
+
+def get_client():
+    global _client
+    with _lock:
+        if _client is None:
+            try:
+                _client = _authorize()
+            except Exception as e:
+                logging.error(f"Gspread Error: {e}")
+        return _client
+
+
+def get_spreadsheet():
+    global _spreadsheet
+    client = get_client()
+    if client is None:
+        return None
+    with _lock:
+        if _spreadsheet is None:
+            # open_by_key не делает поиск по Drive
+            if SHEET_KEY:
+                _spreadsheet = client.open_by_key(SHEET_KEY)
+            else:
+                _spreadsheet = client.open(SHEET_NAME)
+        return _spreadsheet
+
+
+def get_worksheet(worksheet=0):
+    # worksheet — номер листа или его название
+    spreadsheet = get_spreadsheet()
+    if spreadsheet is None:
+        return None
+    with _lock:
+        if worksheet not in _worksheets:
+            if isinstance(worksheet, int):
+                _worksheets[worksheet] = spreadsheet.get_worksheet(worksheet)
+            else:
+                _worksheets[worksheet] = spreadsheet.worksheet(worksheet)
+        return _worksheets[worksheet]
+
+
+def reset():
+    # Сбрасывает открытые хэндлы (например, после переименования таблицы).
+    # Клиент и сессия остаются прежними.
+    global _spreadsheet
+    with _lock:
+        _spreadsheet = None
+        _worksheets.clear()
+        _indexes.clear()
+
+
+# --- ИНДЕКС СТРОК ---
+
+
+class RowIndex:
+    # user_id -> номер строки, строится по колонке A. Организаторы могут
+    # сортировать лист или удалять строки, поэтому перед каждой записью
+    # колонка перечитывается (refresh): старые номера строк указали бы
+    # на чужих участников. Между refresh индекс дополняется appended.
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self._lock = threading.Lock()
+        self._rows = None
+        self._next_row = None
+
+    def _build(self):
+        with metrics.sheets_seconds.time("col_values"):
+            column = self.sheet.col_values(1)
+        self._rows = {}
+        for row, value in enumerate(column, start=1):
+            value = value.strip()
+            if value.isdigit():
+                self._rows[value] = row
+        self._next_row = len(column) + 1
+
+    def refresh(self):
+        with self._lock:
+            self._build()
+
+    def get(self, user_id):
+        with self._lock:
+            if self._rows is None:
+                self._build()
+            return self._rows.get(user_id)
+
+    def appended(self, user_id, row):
+        with self._lock:
+            if self._rows is None:
+                return
+            if row != self._next_row:
+                # Кто-то дописал или удалил строки вручную
+                self._rows = None
+                return
+            self._rows[user_id] = row
+            self._next_row = row + 1
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+
+
+def get_index(sheet):
+    with _lock:
+        if sheet.id not in _indexes:
+            _indexes[sheet.id] = RowIndex(sheet)
+        return _indexes[sheet.id]
+
+
+def _appended_row(response):
+    # "Лист1!A42:J42" -> 42
+    updated_range = response["updates"]["updatedRange"]
+    return a1_to_rowcol(updated_range.split("!")[-1].split(":")[0])[0]
+
+
+# --- СИНХРОННЫЕ ОПЕРАЦИИ ---
+
+
+def _cell_ranges(row, cells):
+    # {10: "Coming"} -> J{row}; соседние колонки склеиваются в один диапазон
+    ranges = []
+    run = []
+    for col in sorted(cells):
+        if run and col != run[-1] + 1:
+            ranges.append(run)
+            run = []
+        run.append(col)
+    if run:
+        ranges.append(run)
+
+    data = []
+    for run in ranges:
+        start = rowcol_to_a1(row, run[0])
+        end = rowcol_to_a1(row, run[-1])
+        data.append({"range": f"{start}:{end}", "values": [[cells[col] for col in run]]})
+    return data
+
+
+def _flush(worksheet, rows, cells):
+    # False — таблица недоступна (нет ключа или авторизации), ничего не записано
+    sheet = get_worksheet(worksheet)
+    if sheet is None:
+        return False
+    index = get_index(sheet)
+    # Один col_values на пачку: номера строк берутся из текущего листа
+    index.refresh()
+
+    data = []
+    new_rows = []
+    for user_id, row_data in rows.items():
+        row = index.get(user_id)
+        if row:
+            data.append({"range": f"A{row}:J{row}", "values": [row_data]})
+        else:
+            new_rows.append(row_data)
+
+    # Новые участники дописываются одним запросом. Если дальше что-то
+    # упадет, при повторе они уже найдутся в индексе и не задвоятся.
+    if new_rows:
+        with metrics.sheets_seconds.time("append_rows"):
+            response = sheet.append_rows(new_rows)
+        first_row = _appended_row(response)
+        for offset, row_data in enumerate(new_rows):
+            index.appended(row_data[0], first_row + offset)
+
+    for user_id, user_cells in cells.items():
+        row = index.get(user_id)
+        if row:
+            data.extend(_cell_ranges(row, user_cells))
+
+    if data:
+        with metrics.sheets_seconds.time("batch_update"):
+            sheet.batch_update(data)
+    return True
+
+
+def _get_all_values(worksheet):
+    sheet = get_worksheet(worksheet)
+    if sheet is None:
+        return None
+    with metrics.sheets_seconds.time("get_all_values"):
+        return sheet.get_all_values()
+
+
+# --- ASYNC API ---
+
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    except Exception as e:
+        code = e.response.status_code if isinstance(e, APIError) else "network"
+        metrics.sheets_errors.inc(str(code))
+        if _invalidates_handles(e):
+            reset()
+        raise
+
+
+def _invalidates_handles(error):
+    # Хэндлы и индекс сбрасываем, только если таблица или лист
+    # изменились: 404, диапазон вне листа (400), лист не найден.
+    # На 429/5xx и сетевых ошибках они остаются рабочими, а повторное
+    # открытие таблицы лишь тратит квоту, которой и так не хватает.
+    if isinstance(error, (SpreadsheetNotFound, WorksheetNotFound)):
+        return True
+    return isinstance(error, APIError) and error.response.status_code in (400, 404)
+
+
+def _is_retryable(error):
+    if not isinstance(error, APIError):
+        # Сетевые ошибки (таймаут, разрыв соединения) тоже повторяем
+        return True
+    code = error.response.status_code
+    return code == 429 or code >= 500
+
+
+async def write(worksheet, rows, cells):
+    # Пачка изменений одного листа: новые строки одним append_rows,
+    # остальное одним batch_update. Сетевые ошибки, 429 и 5xx повторяются
+    # с экспоненциальной паузой. Возвращает True, если запись прошла.
+    for attempt in range(MAX_RETRIES):
+        try:
+            # Без таблицы повторять бессмысленно: строки остаются
+            # грязными до следующего прохода зеркала
+            return await _run(_flush, worksheet, rows, cells)
+        except Exception as e:
+            if not _is_retryable(e):
+                logging.error(f"Sheets flush error: {e}")
+                return False
+            delay = min(2 ** attempt, 60)
+            metrics.sheets_retries.inc()
+            logging.warning(f"Sheets flush retry in {delay}s: {e}")
+            await asyncio.sleep(delay)
+
+    logging.error(f"Sheets flush failed after {MAX_RETRIES} attempts")
+    return False
+
+
+async def get_all_values(worksheet=0):
+    return await _run(_get_all_values, worksheet)
@@ -0,0 +1,293 @@
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+
+import sheets
+
+FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", 2))
+FLUSH_SIZE = int(os.getenv("SHEETS_FLUSH_SIZE", 50))
+MIRROR_BATCH = int(os.getenv("SHEETS_MIRROR_BATCH", 500))
+# Потолок паузы зеркала после ошибок записи подряд
+MIRROR_MAX_BACKOFF = float(os.getenv("SHEETS_MIRROR_MAX_BACKOFF", 300))
+
+FIELDS = (
+    "user_id", "username", "full_name", "email", "direction", "company",
+    "experience", "job_offers", "known_g5", "status",
+    "q1", "q2", "q3", "q4", "q5",
+)
+
+# Что из строки еще не попало в таблицу
+DIRTY_REGISTRATION = 1  # A:J
+DIRTY_STATUS = 2  # J
+DIRTY_FEEDBACK = 4  # K:O
+
+
+class Store:
+    # Основное хранилище участников. Запись сначала коммитится сюда,
+    # в Google Sheets ее потом переносит SheetMirror.
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS attendees (
+                event TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                username TEXT NOT NULL DEFAULT '',
+                full_name TEXT NOT NULL DEFAULT '',
+                email TEXT NOT NULL DEFAULT '',
+                direction TEXT NOT NULL DEFAULT '',
+                company TEXT NOT NULL DEFAULT '',
+                experience TEXT NOT NULL DEFAULT '',
+                job_offers TEXT NOT NULL DEFAULT '',
+                known_g5 TEXT NOT NULL DEFAULT '',
+                status TEXT NOT NULL DEFAULT 'Wait',
+                q1 TEXT NOT NULL DEFAULT '',
+                q2 TEXT NOT NULL DEFAULT '',
+                q3 TEXT NOT NULL DEFAULT '',
+                q4 TEXT NOT NULL DEFAULT '',
+                q5 TEXT NOT NULL DEFAULT '',
+                version INTEGER NOT NULL DEFAULT 0,
+                dirty INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (event, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS attendees_status ON attendees (event, status);
+            CREATE INDEX IF NOT EXISTS attendees_user ON attendees (user_id);
+            CREATE INDEX IF NOT EXISTS attendees_dirty ON attendees (event) WHERE dirty != 0;
+            CREATE INDEX IF NOT EXISTS attendees_direction ON attendees (event, direction);
+            CREATE INDEX IF NOT EXISTS attendees_experience ON attendees (event, experience);
+            CREATE INDEX IF NOT EXISTS attendees_job_offers ON attendees (event, job_offers);
+            CREATE INDEX IF NOT EXISTS attendees_q1 ON attendees (event, CAST(q1 AS INTEGER));
+            CREATE INDEX IF NOT EXISTS attendees_q2 ON attendees (event, CAST(q2 AS INTEGER));
+            CREATE INDEX IF NOT EXISTS attendees_q3 ON attendees (event, CAST(q3 AS INTEGER));
+            CREATE INDEX IF NOT EXISTS attendees_q4 ON attendees (event, CAST(q4 AS INTEGER));
+            CREATE TABLE IF NOT EXISTS imports (
+                event TEXT PRIMARY KEY,
+                imported_at REAL NOT NULL
+            );
+            """
+        )
+        self.db.commit()
+        self.listeners = []
+
+    def _changed(self):
+        self.db.commit()
+        for listener in self.listeners:
+            listener()
+
+    # --- запись ---
+
+    def upsert_registration(self, event_id: str, row_data):
+        values = [int(row_data[0])] + list(row_data[1:10])
+        self.db.execute(
+            """
+            INSERT INTO attendees (event, user_id, username, full_name, email, direction,
+                                   company, experience, job_offers, known_g5, status,
+                                   version, dirty, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (event, user_id) DO UPDATE SET
+                username = excluded.username,
+                full_name = excluded.full_name,
+                email = excluded.email,
+                direction = excluded.direction,
+                company = excluded.company,
+                experience = excluded.experience,
+                job_offers = excluded.job_offers,
+                known_g5 = excluded.known_g5,
+                status = excluded.status,
+                version = version + 1,
+                dirty = dirty | excluded.dirty,
+                updated_at = excluded.updated_at
+            """,
+            [event_id] + values + [DIRTY_REGISTRATION, time.time()],
+        )
+        self._changed()
+
+    def set_status(self, event_id: str, user_id: int, status: str) -> bool:
+        # False — участника нет или статус уже такой
+        cursor = self.db.execute(
+            """
+            UPDATE attendees
+            SET status = ?, version = version + 1, dirty = dirty | ?, updated_at = ?
+            WHERE event = ? AND user_id = ? AND status != ?
+            """,
+            (status, DIRTY_STATUS, time.time(), event_id, user_id, status),
+        )
+        self._changed()
+        return cursor.rowcount > 0
+
+    def save_feedback(self, event_id: str, user_id: int, answers):
+        self.db.execute(
+            """
+            UPDATE attendees
+            SET q1 = ?, q2 = ?, q3 = ?, q4 = ?, q5 = ?,
+                version = version + 1, dirty = dirty | ?, updated_at = ?
+            WHERE event = ? AND user_id = ?
+            """,
+            list(answers)[:5] + [DIRTY_FEEDBACK, time.time(), event_id, user_id],
+        )
+        self._changed()
+
+    def import_rows(self, event_id: str, records):
+        # Первичная загрузка из таблицы, делается один раз на событие.
+        # Записи, которые уже есть локально, не трогаем.
+        rows = []
+        for row in records[1:]:
+            if not row or not str(row[0]).strip().isdigit():
+                continue
+            # Строка без колонки статуса, как и раньше, считается "Wait"
+            status = row[9] if len(row) > 9 else "Wait"
+            row = list(row[:15]) + [""] * (15 - len(row))
+            row[9] = status
+            rows.append([event_id, int(str(row[0]).strip())] + row[1:])
+        self.db.executemany(
+            f"INSERT OR IGNORE INTO attendees (event, {', '.join(FIELDS)}) "
+            f"VALUES ({', '.join('?' * (len(FIELDS) + 1))})",
+            rows,
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO imports (event, imported_at) VALUES (?, ?)", (event_id, time.time())
+        )
+        self.db.commit()
+        return len(rows)
+
+    def is_imported(self, event_id: str) -> bool:
+        return self.db.execute("SELECT 1 FROM imports WHERE event = ?", (event_id,)).fetchone() is not None
+
+    # --- чтение ---
+
+    def count(self, event_id: str) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM attendees WHERE event = ?", (event_id,)).fetchone()[0]
+
+    def get(self, event_id: str, user_id: int):
+        return self.db.execute(
+            f"SELECT {', '.join(FIELDS)} FROM attendees WHERE event = ? AND user_id = ?",
+            (event_id, user_id),
+        ).fetchone()
+
+    def ids(self, event_id: str, statuses=None):
+        if statuses is None:
+            rows = self.db.execute("SELECT user_id FROM attendees WHERE event = ?", (event_id,))
+        else:
+            statuses = list(statuses)
+            rows = self.db.execute(
+                f"SELECT user_id FROM attendees WHERE event = ? AND status IN ({', '.join('?' * len(statuses))})",
+                [event_id] + statuses,
+            )
+        return [row[0] for row in rows]
+
+    def audience(self, event_id: str, audience):
+        # audience — разобранный audience.Audience
+        where = "".join(f" AND {condition}" for condition in audience.where)
+        rows = self.db.execute(
+            f"SELECT user_id FROM attendees WHERE event = ?{where}",
+            [event_id] + audience.params,
+        )
+        return [row[0] for row in rows]
+
+    def dirty(self, event_id: str, limit: int):
+        return self.db.execute(
+            f"SELECT {', '.join(FIELDS)}, version, dirty FROM attendees "
+            "WHERE event = ? AND dirty != 0 LIMIT ?",
+            (event_id, limit),
+        ).fetchall()
+
+    def mark_synced(self, event_id: str, versions):
+        # Если строку успели изменить во время записи, она остается грязной
+        self.db.executemany(
+            "UPDATE attendees SET dirty = 0 WHERE event = ? AND user_id = ? AND version = ?",
+            [(event_id, user_id, version) for user_id, version in versions],
+        )
+        self.db.commit()
+
+
+class SheetMirror:
+    # Фоновая репликация изменений из Store в Google Sheets: раз в
+    # FLUSH_INTERVAL (или после FLUSH_SIZE изменений) грязные строки
+    # каждого события уходят пачкой через sheets.write. Пока таблица
+    # недоступна, строки остаются грязными и ничего не теряется.
+
+    def __init__(self, store: Store, worksheets: dict):
+        self.store = store
+        self.worksheets = worksheets
+        self._changes = 0
+        self._failures = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+        store.listeners.append(self.notify)
+
+    def notify(self):
+        self._changes += 1
+        # Во время паузы после ошибок поток изменений ее не прерывает
+        if self._changes >= FLUSH_SIZE and not self._failures:
+            self._wakeup.set()
+
+    async def flush(self) -> bool:
+        # False — часть строк записать не удалось, они остались грязными
+        self._changes = 0
+        ok = True
+        for event_id, worksheet in self.worksheets.items():
+            while True:
+                batch = self.store.dirty(event_id, MIRROR_BATCH)
+                if not batch:
+                    break
+                rows = {}
+                cells = {}
+                for record in batch:
+                    values = ["" if value is None else str(value) for value in record[:15]]
+                    user_id, dirty = values[0], record[16]
+                    if dirty & DIRTY_REGISTRATION:
+                        rows[user_id] = values[:10]
+                    elif dirty & DIRTY_STATUS:
+                        cells.setdefault(user_id, {})[10] = values[9]
+                    if dirty & DIRTY_FEEDBACK:
+                        cells.setdefault(user_id, {}).update(enumerate(values[10:15], start=11))
+                if not await sheets.write(worksheet, rows, cells):
+                    ok = False
+                    break
+                self.store.mark_synced(event_id, [(record[0], record[15]) for record in batch])
+                if len(batch) < MIRROR_BATCH:
+                    break
+        return ok
+
+    def _delay(self) -> float:
+        # После ошибок подряд пауза растет экспоненциально: постоянная
+        # ошибка (403, 400 со сбросом хэндлов) иначе тратила бы запросы
+        # к Sheets каждые FLUSH_INTERVAL
+        return min(FLUSH_INTERVAL * 2 ** min(self._failures, 16), MIRROR_MAX_BACKOFF)
+
+    async def _loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._delay())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                ok = await self.flush()
+            except Exception as e:
+                logging.error(f"Sheets mirror error: {e}")
+                ok = False
+            self._failures = 0 if ok else self._failures + 1
+            if self._failures:
+                logging.warning(f"Sheets mirror: {self._failures} failed flushes, next in {self._delay():.0f}s")
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        # Дожидаемся текущей записи, затем отправляем остаток
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
@@ -0,0 +1,97 @@
+import os
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+import metrics
+
+# Повторное нажатие той же кнопки в том же состоянии в течение окна — дубль
+DEBOUNCE = float(os.getenv("THROTTLE_DEBOUNCE", 2))
+# Не больше RATE апдейтов от одного пользователя за WINDOW секунд
+RATE = int(os.getenv("THROTTLE_RATE", 20))
+WINDOW = float(os.getenv("THROTTLE_WINDOW", 10))
+CACHE_SIZE = int(os.getenv("THROTTLE_CACHE_SIZE", 10000))
+
+
+class TTLCache:
+    # Небольшой LRU-кэш, записи которого истекают через ttl секунд
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return default
+        return value
+
+    def set(self, key, value):
+        self._items[key] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def incr(self, key) -> int:
+        # Счетчик в пределах окна: срок жизни отсчитывается от первого значения
+        value = self.get(key)
+        if value is None:
+            self.set(key, 1)
+            return 1
+        expires_at = self._items[key][1]
+        self._items[key] = (value + 1, expires_at)
+        return value + 1
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Outer-middleware на апдейты: отбрасывает дубли (тот же текст или
+    # callback в том же FSM-состоянии) и ограничивает частоту апдейтов
+    # от одного пользователя, чтобы спам кнопками не доходил до хендлеров.
+
+    def __init__(self, debounce: float = DEBOUNCE, rate: int = RATE, window: float = WINDOW,
+                 cache_size: int = CACHE_SIZE):
+        self.rate = rate
+        self._recent = TTLCache(cache_size, debounce)
+        self._windows = TTLCache(cache_size, window)
+
+    @staticmethod
+    def _signature(update):
+        if update.message is not None:
+            message = update.message
+            return message.from_user and message.from_user.id, message.text
+        if update.callback_query is not None:
+            query = update.callback_query
+            return query.from_user.id, query.data
+        return None, None
+
+    def _reason(self, user_id, content, state):
+        if content is not None:
+            key = (user_id, state, content)
+            if key in self._recent:
+                return "duplicate"
+            self._recent.set(key, True)
+        if self._windows.incr(user_id) > self.rate:
+            return "rate_limit"
+        return None
+
+    async def __call__(self, handler, event, data):
+        user_id, content = self._signature(event)
+        if user_id is None:
+            return await handler(event, data)
+        reason = self._reason(user_id, content, data.get("raw_state"))
+        if reason is None:
+            return await handler(event, data)
+        metrics.updates_dropped.inc(reason)
+        if event.callback_query is not None:
+            # Убираем «часики» на кнопке, ничего не делая
+            await event.callback_query.answer()
+        return None